@@ -0,0 +1,203 @@
+"""
+Local stand-in for an OpenAI compatible chat completions endpoint.
+
+Replies are generated from a fixed markdown sample, streamed as server
+sent events one token at a time after a configurable latency and at a
+configurable rate. Point litellm at it with
+
+    OPENAI_API_BASE=http://127.0.0.1:<port>/v1 OPENAI_API_KEY=fake
+
+and any `openai/<name>` model.
+
+    python benchmarks/fake_server.py --port 8765 --ttft 0.3 --rate 80
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+SAMPLE = """## Result
+
+The function below reads the file in chunks and **stops** at the first
+match, so memory stays flat even for large inputs.
+
+```python
+def find(path, needle):
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if needle in line:
+                return i
+    return None
+```
+
+- It returns the line number, or `None` when nothing matches.
+- Lines are compared as *text*, decode errors are not handled.
+
+"""
+
+
+def make_tokens(count: int) -> List[str]:
+    """
+    Split the sample in about four characters per token and repeat it
+    until `count` tokens are produced.
+    """
+
+    pieces: List[str] = []
+    for i in range(0, len(SAMPLE), 4):
+        pieces.append(SAMPLE[i : i + 4])
+    tokens = []
+    while len(tokens) < count:
+        tokens.extend(pieces)
+    return tokens[:count]
+
+
+class Settings:
+    def __init__(self, ttft: float, rate: float, tokens: int):
+        self.ttft = ttft
+        # tokens per second, 0 streams as fast as possible
+        self.rate = rate
+        self.tokens = tokens
+
+
+class Handler(BaseHTTPRequestHandler):
+    settings: Settings
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _chunk(self, delta: dict, finish: Optional[str] = None, **extra) -> bytes:
+        data = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "bench",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            **extra,
+        }
+        return f"data: {json.dumps(data)}\n\n".encode("utf8")
+
+    def _write(self, data: bytes) -> None:
+        # chunked transfer encoding, one chunk per event
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_HEAD(self) -> None:
+        # connection warming, the status does not matter
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        settings = self.settings
+        tokens = make_tokens(settings.tokens)
+        prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+
+        time.sleep(settings.ttft)
+        if not request.get("stream"):
+            body = json.dumps(
+                {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": "bench",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {
+                                "role": "assistant",
+                                "content": "".join(tokens),
+                            },
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": usage,
+                }
+            ).encode("utf8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        self._write(self._chunk({"role": "assistant", "content": ""}))
+        start = time.monotonic()
+        for i, token in enumerate(tokens):
+            if settings.rate > 0:
+                delay = start + i / settings.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self._write(self._chunk({"content": token}))
+        self._write(self._chunk({}, "stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            self._write(self._chunk({}, None, choices=[], usage=usage))
+        self._write(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeServer:
+    """
+    Server running in a background thread, settings can be changed
+    between requests.
+    """
+
+    def __init__(self, ttft: float = 0.0, rate: float = 0.0, tokens: int = 500):
+        self.settings = Settings(ttft, rate, tokens)
+        handler = type("BoundHandler", (Handler,), {"settings": self.settings})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self) -> "FakeServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake streaming LLM server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument(
+        "--ttft", type=float, default=0.0, help="Seconds before the first token"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0.0, help="Tokens per second, 0 is unlimited"
+    )
+    parser.add_argument(
+        "--tokens", type=int, default=500, help="Tokens per response"
+    )
+    args = parser.parse_args()
+
+    Handler.settings = Settings(args.ttft, args.rate, args.tokens)
+    httpd = ThreadingHTTPServer(("127.0.0.1", args.port), Handler)
+    print(f"listening on http://127.0.0.1:{args.port}/v1")
+    httpd.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
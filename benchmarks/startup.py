@@ -0,0 +1,201 @@
+"""
+Measure cold startup of the juggler CLI.
+
+Every case is executed in a fresh interpreter with `python -X importtime`,
+so each sample pays the full import cost. Subcommands run their real
+path: requests go to the local server of `fake_server.py` with a
+throwaway home directory, the shell reads one prompt from its input and
+the TUI runs headless and quits once it is ready.
+
+The median wall time of each case, relative to `--help`, and its imports
+are compared against the budget in `startup_budget.json`. Ratios keep
+the budget meaningful on machines of any speed. The script exits with a
+non-zero status if any case regresses or imports a module it is not
+allowed to.
+
+    python benchmarks/startup.py            # check against budget
+    python benchmarks/startup.py --update   # rewrite budget from this machine
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+
+from fake_server import FakeServer  # noqa: E402
+
+ROOT = pathlib.Path(__file__).parent.parent.resolve()
+BUDGET = pathlib.Path(__file__).parent.joinpath("startup_budget.json")
+# case the others are measured against
+BASELINE = "help"
+
+# a model served by the fake server, without cached responses
+REQUEST = ["-m", "juggler", "--model", "gpt-4o", "--no-cache"]
+
+# case name -> arguments given to the interpreter and its standard input,
+# "{source}" is replaced by a file to complete
+CASES: Dict[str, Tuple[List[str], str]] = {
+    "help": (["-m", "juggler", "--help"], ""),
+    "list": (["-m", "juggler", "list"], ""),
+    "run": ([*REQUEST, "run", "test"], ""),
+    "complete": ([*REQUEST, "complete", "{source}"], ""),
+    "shell": ([*REQUEST, "shell"], "hello\n"),
+    "tui": ([*REQUEST, "tui"], ""),
+}
+
+CONFIG = """\
+openai:
+  key: "fake"
+anthropic: null
+deepseek: null
+gemini: null
+"""
+
+
+@contextlib.contextmanager
+def environment() -> Iterator[Dict[str, str]]:
+    """
+    Environment of the cases: a home directory holding only a config and
+    a fake provider answering a few tokens.
+    """
+
+    with FakeServer(tokens=20) as server, tempfile.TemporaryDirectory() as home:
+        config = pathlib.Path(home, ".config/juggler")
+        config.mkdir(parents=True)
+        config.joinpath("juggler.yaml").write_text(CONFIG)
+        yield dict(
+            os.environ,
+            HOME=home,
+            OPENAI_API_BASE=server.base_url,
+            TEXTUAL_DRIVER="textual.drivers.headless_driver:HeadlessDriver",
+            TEXTUAL_PRESS="ctrl+q",
+        )
+
+
+def sample(
+    args: List[str], stdin: str, env: Dict[str, str]
+) -> Tuple[float, float, List[str]]:
+    """
+    Run one cold interpreter and return wall time (ms), total import
+    time (ms) and the list of imported top level packages.
+    """
+
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT,
+        env=env,
+        input=stdin,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    wall = (time.perf_counter() - start) * 1000
+
+    imported = 0
+    modules = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        imported += int(self_us)
+        modules.append(name.strip().split(".")[0])
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} exited with {proc.returncode}")
+
+    return wall, imported / 1000, modules
+
+
+def measure(runs: int) -> Dict[str, dict]:
+    results = {}
+    with environment() as env:
+        source = pathlib.Path(env["HOME"], "source.py")
+        for name, (args, stdin) in CASES.items():
+            args = [arg.replace("{source}", str(source)) for arg in args]
+            walls, imports = [], []
+            modules: List[str] = []
+            for _ in range(runs):
+                source.write_text("def main():\n")
+                wall, imported, modules = sample(args, stdin, env)
+                walls.append(wall)
+                imports.append(imported)
+            results[name] = {
+                "wall_ms": statistics.median(walls),
+                "import_ms": statistics.median(imports),
+                "modules": sorted(set(modules)),
+            }
+
+    baseline = results[BASELINE]["wall_ms"]
+    for result in results.values():
+        result["ratio"] = result["wall_ms"] / baseline
+    return results
+
+
+def check(results: Dict[str, dict], budget: Dict[str, dict]) -> List[str]:
+    failures = []
+    for name, result in results.items():
+        limits = budget.get(name)
+        if limits is None:
+            continue
+        if "max_ratio" in limits and result["ratio"] > limits["max_ratio"]:
+            failures.append(
+                f"{name}: wall {result['ratio']:.2f}x {BASELINE}"
+                f" > {limits['max_ratio']}x"
+            )
+        for module in limits.get("forbid", []):
+            if module in result["modules"]:
+                failures.append(f"{name}: imports forbidden module {module}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="juggler startup benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="Samples per case")
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Rewrite budget with current ratios plus slack",
+    )
+    parser.add_argument(
+        "--slack", type=float, default=1.3, help="Budget multiplier for --update"
+    )
+    args = parser.parse_args()
+
+    budget = json.loads(BUDGET.read_text()) if BUDGET.exists() else {}
+    results = measure(args.runs)
+
+    for name, result in results.items():
+        print(
+            f"{name:10} wall {result['wall_ms']:8.1f}ms {result['ratio']:6.2f}x"
+            f"  import {result['import_ms']:8.1f}ms"
+        )
+
+    if args.update:
+        for name, result in results.items():
+            if name == BASELINE:
+                continue
+            entry = budget.setdefault(name, {})
+            entry["max_ratio"] = round(result["ratio"] * args.slack, 2)
+        BUDGET.write_text(json.dumps(budget, indent=2) + "\n")
+        print(f"budget written to {BUDGET}")
+        return
+
+    failures = check(results, budget)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Offline benchmarks of the juggler hot paths.
+
+Requests go to the local server of `fake_server.py`, so results do not
+depend on a provider and no key is needed. Cases:
+
+    startup     cold CLI startup per subcommand (see startup.py)
+    template    Template.arun time and its overhead over a bare stream
+    tui         tokens/sec sustained by the Baloon streaming pipeline
+    paging      filling a tall terminal from a long session, then paging up
+    shell       cost of refreshing the shell agent markdown view
+    complete    throughput of `complete` appending to a file
+
+Every case runs in its own interpreter with its own server, so cases
+do not share imports, HTTP clients or event loops. Results can be
+written as JSON and compared with an earlier run:
+
+    python benchmarks/suite.py --output base.json
+    python benchmarks/suite.py --compare base.json --tolerance 0.2
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+ROOT = pathlib.Path(__file__).parent.parent.resolve()
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(pathlib.Path(__file__).parent))
+
+from fake_server import FakeServer, make_tokens  # noqa: E402
+
+MODEL = "openai/bench"
+
+# case name -> metric name -> {"value", "unit", "better"}, where better
+# is "lower", "higher" or "info" for metrics that are never compared
+Results = Dict[str, Dict[str, dict]]
+
+
+def metric(value: float, unit: str, better: str) -> dict:
+    return {"value": round(value, 3), "unit": unit, "better": better}
+
+
+def bench_startup(server: FakeServer, runs: int) -> Dict[str, dict]:
+    import startup
+
+    results = {}
+    for name, result in startup.measure(runs).items():
+        results[f"{name}_wall"] = metric(result["wall_ms"], "ms", "lower")
+    return results
+
+
+def bench_template(server: FakeServer, runs: int) -> Dict[str, dict]:
+    from juggler.llm import astream
+    from juggler.template import Template
+
+    server.settings.ttft = 0
+    server.settings.rate = 0
+    server.settings.tokens = 200
+
+    prompt = (
+        "{{ system() }}{{ cache() }}You answer questions.\n---\n"
+        "{{ user() }}{% for f in context %}{{ f }}\n{% endfor %}{{ question }}\n---\n"
+        "{{ assistant() }}"
+    )
+    template = Template(MODEL, prompt, quiet=True)
+    context = [f"file {i}\n" + "x = 1\n" * 200 for i in range(20)]
+    # the bare stream sends the same messages the template renders
+    messages: List[dict] = []
+
+    async def bare() -> None:
+        async for _ in astream(MODEL, messages):
+            pass
+
+    async def run_template() -> None:
+        chat = await template.arun(context, [], {"question": "question"})  # pyright: ignore
+        messages[:] = chat.to_dict()[:-1]
+
+    async def timed(fn: Callable, n: int) -> List[float]:
+        await fn()  # warm up connections and imports
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            await fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    async def both(n: int) -> List[List[float]]:
+        await run_template()
+        return [await timed(bare, n), await timed(run_template, n)]
+
+    bare_samples, template_samples = asyncio.run(both(runs * 4))
+    bare_ms = statistics.median(bare_samples)
+    template_ms = statistics.median(template_samples)
+    return {
+        "run": metric(template_ms, "ms", "lower"),
+        # difference of two network bound medians, too noisy to gate on
+        "overhead": metric(template_ms - bare_ms, "ms", "info"),
+    }
+
+
+def bench_tui(server: FakeServer, runs: int) -> Dict[str, dict]:
+    from textual.widgets import Input
+    from juggler.store import SessionStore
+    from juggler.tui import Juggler
+
+    server.settings.ttft = 0
+    server.settings.rate = 0
+    server.settings.tokens = 2000
+
+    async def one(store_path: pathlib.Path) -> float:
+        store = SessionStore(store_path)
+        app = Juggler(MODEL, store)
+        async with app.run_test(size=(120, 40)) as pilot:
+            app.query_one(Input).value = "hello"
+            start = time.perf_counter()
+            await pilot.press("enter")
+            while len(app.current_chat.messages) < 2:
+                await pilot.pause(0.01)
+            elapsed = time.perf_counter() - start
+        store.close()
+        return server.settings.tokens / elapsed
+
+    async def all_runs(tmp: str) -> List[float]:
+        return [await one(pathlib.Path(tmp, f"sessions{i}.db")) for i in range(runs)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rates = asyncio.run(all_runs(tmp))
+    return {"stream": metric(statistics.median(rates), "tok/s", "higher")}
+
+
+def bench_paging(server: FakeServer, runs: int) -> Dict[str, dict]:
+    from juggler.message import Message, MessageType
+    from juggler.store import SessionStore
+    from juggler.tui import Juggler
+
+    # a first page of short messages does not fill this terminal, older
+    # pages must still be mounted and reachable by scrolling up
+    size = (120, 200)
+    messages = 500
+    pages = 3
+    deadline = 60.0
+
+    async def wait(pilot, ready: Callable[[], bool], what: str) -> None:
+        start = time.perf_counter()
+        while not ready():
+            if time.perf_counter() - start > deadline:
+                raise RuntimeError(f"paging: {what} after {deadline}s")
+            await pilot.pause(0.01)
+
+    async def one(store_path: pathlib.Path) -> Tuple[float, List[float]]:
+        store = SessionStore(store_path)
+        app = Juggler(MODEL, store)
+        async with app.run_test(size=size) as pilot:
+            chat = app.current_chat
+            for i in range(messages):
+                kind = MessageType.AI if i % 2 else MessageType.USER
+                app.add_message(Message(kind, f"message {i}"), chat)
+            body = app.body
+
+            start = time.perf_counter()
+            await body.show(chat.messages)
+            await wait(
+                pilot,
+                lambda: not body.paging and body.max_scroll_y > body.size.height,
+                "the window does not fill the terminal",
+            )
+            fill = time.perf_counter() - start
+
+            page_ups = []
+            for _ in range(pages):
+                first = body.start
+                start = time.perf_counter()
+                body.scroll_home(animate=False)
+                await wait(
+                    pilot,
+                    lambda: not body.paging and body.start < first,
+                    "older messages are not reachable",
+                )
+                page_ups.append(time.perf_counter() - start)
+        store.close()
+        return fill, page_ups
+
+    async def all_runs(tmp: str) -> List[Tuple[float, List[float]]]:
+        return [await one(pathlib.Path(tmp, f"sessions{i}.db")) for i in range(runs)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = asyncio.run(all_runs(tmp))
+    return {
+        "fill": metric(statistics.median(s[0] for s in samples) * 1000, "ms", "lower"),
+        "page_up": metric(
+            statistics.median(t for s in samples for t in s[1]) * 1000, "ms", "lower"
+        ),
+    }
+
+
+def bench_shell(server: FakeServer, runs: int) -> Dict[str, dict]:
+    from rich.console import Console
+    from juggler.sh import StreamingMarkdown
+
+    tokens = make_tokens(2000)
+    # refresh every 10 tokens, like a 4Hz refresh of a 40 tok/s stream
+    every = 10
+
+    samples = []
+    for _ in range(runs):
+        console = Console(file=io.StringIO(), width=100, force_terminal=True)
+        view = StreamingMarkdown()
+        start = time.perf_counter()
+        for i, token in enumerate(tokens):
+            view.feed(token)
+            if i % every == 0:
+                console.print(view)
+        console.print(view)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    refreshes = len(tokens) // every + 1
+    total = statistics.median(samples)
+    return {
+        "render": metric(total, "ms", "lower"),
+        "refresh": metric(total / refreshes, "ms", "lower"),
+    }
+
+
+def bench_complete(server: FakeServer, runs: int) -> Dict[str, dict]:
+    from juggler.complete import complete
+
+    server.settings.ttft = 0
+    server.settings.rate = 0
+    server.settings.tokens = 5000
+
+    rates = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp, "source.py")
+        for _ in range(runs):
+            path.write_text("def main():\n    pass\n" * 50000)
+            size = path.stat().st_size
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                complete(MODEL, path)
+            elapsed = time.perf_counter() - start
+            rates.append((path.stat().st_size - size) / 1024 / elapsed)
+    return {"append": metric(statistics.median(rates), "KiB/s", "higher")}
+
+
+CASES: Dict[str, Callable[[FakeServer, int], Dict[str, dict]]] = {
+    "startup": bench_startup,
+    "template": bench_template,
+    "tui": bench_tui,
+    "paging": bench_paging,
+    "shell": bench_shell,
+    "complete": bench_complete,
+}
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[str]:
+    regressions = []
+    for case, metrics in results.items():
+        for name, current in metrics.items():
+            previous = baseline.get(case, {}).get(name)
+            if previous is None or previous["value"] == 0:
+                continue
+            change = (current["value"] - previous["value"]) / abs(previous["value"])
+            if current["better"] == "lower":
+                worse = change > tolerance
+            elif current["better"] == "higher":
+                worse = change < -tolerance
+            else:
+                worse = False
+            mark = "REGRESSION" if worse else ""
+            print(
+                f"{case}.{name:16} {previous['value']:>10} -> {current['value']:>10}"
+                f" {current['unit']:6} {change:+7.1%} {mark}"
+            )
+            if worse:
+                regressions.append(f"{case}.{name}")
+    return regressions
+
+
+def run_case(case: str, runs: int) -> Dict[str, dict]:
+    proc = subprocess.run(
+        [sys.executable, __file__, "--child", case, "--runs", str(runs)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"case {case} exited with {proc.returncode}")
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def child(case: str, runs: int) -> None:
+    os.environ["OPENAI_API_KEY"] = "fake"
+    with FakeServer() as server:
+        os.environ["OPENAI_API_BASE"] = server.base_url
+        result = CASES[case](server, runs)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="juggler offline benchmarks")
+    parser.add_argument("cases", nargs="*", help="Cases to run, all by default")
+    parser.add_argument("--runs", type=int, default=3, help="Samples per case")
+    parser.add_argument("--output", type=str, help="Write results as JSON")
+    parser.add_argument("--compare", type=str, help="Compare with a JSON result")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative change reported as a regression",
+    )
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.runs)
+        return
+    for case in args.cases:
+        if case not in CASES:
+            parser.error(f"unknown case {case}, choose from {', '.join(CASES)}")
+
+    results: Results = {}
+    for case in args.cases or CASES:
+        results[case] = run_case(case, args.runs)
+        for name, m in results[case].items():
+            print(f"{case}.{name:16} {m['value']:>10} {m['unit']}")
+
+    if args.output:
+        pathlib.Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.compare:
+        baseline = json.loads(pathlib.Path(args.compare).read_text())
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,23 @@
 import argparse
 import logging
 import os
-import glob
 import pathlib
-from juggler.tui import Juggler
-from juggler.template import TemplateLoader
-from juggler.model import ContextFile
-from juggler.sh import SHAgent
-from juggler.config import read_config, Config
-import juggler.complete as comp
+import sys
+from juggler.config import read_config, cache_dir, Config
+from typing import List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from juggler.compaction import Compactor
+    from juggler.cache import ResponseCache
+    from juggler.model import ContextFile
+    from juggler.retrieval import Retriever
+    from juggler.routing import Router
+    from juggler.store import SessionStore
+    from juggler.telemetry import Telemetry
+    from juggler.template import Context
+
+# Subcommand modules are imported inside each handler so that `list` and
+# `--help` do not pay for loading litellm, textual and rich.
 
 
 def init(config: Config) -> None:
@@ -24,28 +33,95 @@ def init(config: Config) -> None:
         os.environ["GEMINI_API_KEY"] = config.gemini.key
 
 
+def positive_float(value: str) -> float:
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
+def compactor(config: Config) -> Optional["Compactor"]:
+    from juggler.compaction import Compactor
+
+    c = config.compaction
+    if not c.enabled:
+        return None
+    return Compactor(c.max_tokens, c.keep_last, c.summarize, c.model)
+
+
+def session_store() -> "SessionStore":
+    from juggler.store import SessionStore
+
+    return SessionStore(pathlib.Path.home().joinpath(".config/juggler/sessions.db"))
+
+
 def tui(args: argparse.Namespace, config: Config) -> None:
-    app = Juggler(args.model)
+    from juggler.tui import Juggler
+
+    store = session_store()
+    app = Juggler(args.model, store, compactor(config), args.on_busy)
     app.run()
+    store.close()
+
+
+def search(args: argparse.Namespace, config: Config) -> None:
+    from juggler.search import print_hits
+
+    store = session_store()
+    print_hits(store.search(" ".join(args.query), args.limit))
+    store.close()
 
 
 def list_templates(args: argparse.Namespace, config: Config) -> None:
-    args.loader.list()
+    args.catalog.print(args.names)
+
+
+def completion(args: argparse.Namespace, config: Config) -> None:
+    script = pathlib.Path(__file__).parent.joinpath("completion.bash")
+    print(script.read_text(), end="")
+
+
+def load_context_files(args: argparse.Namespace) -> "Context":
+    from juggler.context import load_context
+    from juggler.packing import pack_context
+
+    if args.context_dir is None:
+        return []
+
+    logging.info("loading context files from %s", args.context_dir)
+    report = load_context(args.context_dir, args.max_file_bytes, args.max_total_bytes)
+    if args.retrieve is not None:
+        return context_retriever(args, report.files)
+
+    report = pack_context(report, args.model, args.context_tokens)
+    report.print()
+    return report.files
+
+
+def context_retriever(
+    args: argparse.Namespace, files: List["ContextFile"]
+) -> "Retriever":
+    from juggler.retrieval import ChunkIndex, Retriever, index_path
+
+    index = ChunkIndex(index_path(cache_dir(), args.context_dir))
+    embedded = index.update(files)
+    print(
+        f"retrieval: {len(index.rows)} chunks from {len(files)} files,"
+        f" {embedded} embedded, {args.retrieve} per question",
+        file=sys.stderr,
+    )
+    return Retriever(index, args.retrieve, args.retrieve_var)
 
 
 def run(args: argparse.Namespace, config: Config) -> None:
-    logging.info("loading context files from", args.context_dir)
-    context = []
-    if args.context_dir is not None:
-        context_glob = glob.iglob(args.context_dir)
-        for fname in context_glob:
-            with open(fname, "r") as f:
-                context.append(
-                    ContextFile(
-                        filename=fname,
-                        content=f.read(),
-                    )
-                )
+    context = load_context_files(args)
 
     logging.info("reading input files")
     inputs = []
@@ -54,16 +130,102 @@ def run(args: argparse.Namespace, config: Config) -> None:
 
     t = args.loader.get_by_name(args.model, args.template + ".j2")
     if t:
+        from juggler.llm import usage
+
         t.run(context, inputs)
+        usage().print()
+
+
+def batch(args: argparse.Namespace, config: Config) -> None:
+    import asyncio
+    from juggler.batch import read_items, run_batch
+    from juggler.llm import usage
+
+    context = load_context_files(args)
+    t = args.loader.get_by_name(args.model, args.template + ".j2", quiet=True)
+    if t is None:
+        logging.error("template %s not found", args.template)
+        return
+
+    items = read_items(args.files, args.jsonl)
+    asyncio.run(
+        run_batch(
+            t,
+            context,
+            items,
+            pathlib.Path(args.output),
+            args.concurrency,
+        )
+    )
+    usage().print()
+
+
+def response_cache(config: Config) -> "ResponseCache":
+    from juggler.cache import ResponseCache
+
+    return ResponseCache(
+        cache_dir().joinpath("responses.db"),
+        ttl=config.cache.ttl,
+        max_bytes=config.cache.max_bytes,
+    )
+
+
+def router(config: Config) -> "Router":
+    from juggler.routing import Router
+
+    return Router(
+        config.routing.groups,
+        config.routing.hedge_after,
+        cache_dir().joinpath("routing.json"),
+    )
+
+
+def telemetry(config: Config) -> "Telemetry":
+    from juggler.telemetry import Telemetry
+
+    prometheus = config.telemetry.prometheus
+    return Telemetry(
+        cache_dir().joinpath("telemetry.db"),
+        pathlib.Path(prometheus).expanduser() if prometheus else None,
+    )
+
+
+def stats(args: argparse.Namespace, config: Config) -> None:
+    t = telemetry(config)
+    t.print_stats(args.by, args.days)
+    t.close()
+
+
+def cache(args: argparse.Namespace, config: Config):
+    c = response_cache(config)
+    if args.clear:
+        c.clear()
+    for name, value in c.stats().items():
+        print(f"{name}: {value}")
 
 
 def complete(args: argparse.Namespace, config: Config):
-    comp.complete(args.model, args.filename)
+    import juggler.complete as comp
+
+    comp.complete(
+        args.model, pathlib.Path(args.filename), args.head_bytes, args.tail_bytes
+    )
 
 
 def shell(args: argparse.Namespace, config: Config):
-    sh = SHAgent(args.model)
-    sh.run()
+    from juggler.sh import SHAgent
+
+    sh = SHAgent(
+        args.model,
+        args.refresh_rate,
+        compactor(config),
+        args.timeout,
+        args.max_output_bytes,
+    )
+    try:
+        sh.run()
+    finally:
+        sh.close()
 
 
 def main():
@@ -82,39 +244,183 @@ def main():
             "deepseek/deepseek-chat",
             "deepseek/deepseek-coder",
             "gemini/gemini-2.0-flash",
+            *config.routing.groups,
         ],
         default="anthropic/claude-3-5-sonnet-20240620",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write cached responses",
+    )
     subparsers = parser.add_subparsers(dest="command")
 
-    subparsers.add_parser("list", help="List available templates")
-    subparsers.add_parser("tui", help="Run TUI")
+    list_parser = subparsers.add_parser("list", help="List available templates")
+    list_parser.add_argument(
+        "--names", action="store_true", help="Print only template names"
+    )
+    subparsers.add_parser("completion", help="Print bash completion script")
+    tui_parser = subparsers.add_parser("tui", help="Run TUI")
+    tui_parser.add_argument(
+        "--on-busy",
+        choices=["queue", "replace"],
+        default="queue",
+        help="Queue messages sent while a reply streams, or stop the reply",
+    )
 
-    run_parser = subparsers.add_parser("run", help="Run template")
-    run_parser.add_argument(
-        "--context-dir", type=str, default=None, help="Add specified files to context"
+    # context options shared by run and batch
+    context_parser = argparse.ArgumentParser(add_help=False)
+    context_parser.add_argument(
+        "--context-dir",
+        type=str,
+        default=None,
+        help="Add files to context, either a directory or a glob (** is recursive)",
+    )
+    context_parser.add_argument(
+        "--max-file-bytes",
+        type=int,
+        default=256 * 1024,
+        help="Skip context files larger than this",
+    )
+    context_parser.add_argument(
+        "--max-total-bytes",
+        type=int,
+        default=2 * 1024 * 1024,
+        help="Maximum total size of context files",
+    )
+    context_parser.add_argument(
+        "--context-tokens",
+        type=int,
+        default=None,
+        help="Token budget for context files, defaults to the model context window",
+    )
+    context_parser.add_argument(
+        "--retrieve",
+        type=int,
+        default=None,
+        metavar="K",
+        help="Send only the K context chunks most relevant to the question",
+    )
+    context_parser.add_argument(
+        "--retrieve-var",
+        type=str,
+        default="question",
+        help="Template variable holding the question used for retrieval",
+    )
+
+    run_parser = subparsers.add_parser(
+        "run", help="Run template", parents=[context_parser]
     )
     run_parser.add_argument("template", help="Template name")
     run_parser.add_argument(
         "files", nargs="*", type=argparse.FileType("r"), help="Input files"
     )
 
+    batch_parser = subparsers.add_parser(
+        "batch", help="Run template once per input", parents=[context_parser]
+    )
+    batch_parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Run once per line of the input files, fields are template variables",
+    )
+    batch_parser.add_argument(
+        "-o", "--output", required=True, help="JSONL file receiving results"
+    )
+    batch_parser.add_argument(
+        "--concurrency", type=positive_int, default=8, help="Maximum requests in flight"
+    )
+    batch_parser.add_argument("template", help="Template name")
+    batch_parser.add_argument("files", nargs="+", help="Input files")
+
     file_parser = subparsers.add_parser("complete", help="Autocomplete end of file")
+    file_parser.add_argument(
+        "--head-bytes",
+        type=int,
+        default=0,
+        help="Bytes from the start of the file sent with the tail",
+    )
+    file_parser.add_argument(
+        "--tail-bytes",
+        type=int,
+        default=16 * 1024,
+        help="Bytes from the end of the file sent to the model",
+    )
     file_parser.add_argument("filename", help="Filename")
 
-    subparsers.add_parser("shell", help="Shell Agent")
+    shell_parser = subparsers.add_parser("shell", help="Shell Agent")
+    shell_parser.add_argument(
+        "--refresh-rate",
+        type=positive_float,
+        default=4,
+        help="Maximum redraws per second of the streamed answer",
+    )
+    shell_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="Seconds before a running command is killed",
+    )
+    shell_parser.add_argument(
+        "--max-output-bytes",
+        type=int,
+        default=16 * 1024,
+        help="Bytes of command output kept for the conversation",
+    )
+
+    search_parser = subparsers.add_parser("search", help="Search chat sessions")
+    search_parser.add_argument(
+        "--limit", type=int, default=20, help="Maximum number of messages shown"
+    )
+    search_parser.add_argument("query", nargs="+", help="Words to search for")
+
+    stats_parser = subparsers.add_parser("stats", help="Show request latencies")
+    stats_parser.add_argument(
+        "--by",
+        choices=["model", "template"],
+        default="model",
+        help="Group requests by model or by template",
+    )
+    stats_parser.add_argument(
+        "--days", type=float, default=7, help="Include requests of the last days"
+    )
+
+    cache_parser = subparsers.add_parser("cache", help="Response cache statistics")
+    cache_parser.add_argument(
+        "--clear", action="store_true", help="Remove all cached responses"
+    )
 
     args = parser.parse_args()
 
-    # add template loader to args
+    use_cache = config.cache.enabled and not args.no_cache
+    if args.command in ("tui", "run", "batch", "complete", "shell"):
+        import juggler.llm as llm
+
+        llm.configure(
+            response_cache(config) if use_cache else None,
+            router(config) if config.routing.groups else None,
+            telemetry(config) if config.telemetry.enabled else None,
+        )
+
+    from juggler.catalog import TemplateCatalog
+
+    # add template catalog and loader to args
     pkg_dir = pathlib.Path(__file__).parent.resolve().joinpath("prompts")
     config_dir = pathlib.Path.home().joinpath(".config/juggler/prompts")
-    args.loader = TemplateLoader(
-        [
-            pkg_dir,
-            config_dir,
-        ]
-    )
+    dirs = [
+        pkg_dir,
+        config_dir,
+    ]
+    args.catalog = TemplateCatalog(dirs, cache_dir().joinpath("catalog.json"))
+
+    if args.command in ("run", "batch"):
+        from juggler.template import TemplateLoader
+
+        bytecode_dir = None
+        if config.templates.bytecode_cache:
+            bytecode_dir = cache_dir().joinpath("jinja")
+            bytecode_dir.mkdir(exist_ok=True)
+        args.loader = TemplateLoader(dirs, args.catalog, bytecode_dir)
 
     if args.command == "tui":
         tui(args, config)
@@ -122,10 +428,20 @@ def main():
         list_templates(args, config)
     elif args.command == "run":
         run(args, config)
+    elif args.command == "batch":
+        batch(args, config)
     elif args.command == "complete":
         complete(args, config)
     elif args.command == "shell":
         shell(args, config)
+    elif args.command == "cache":
+        cache(args, config)
+    elif args.command == "stats":
+        stats(args, config)
+    elif args.command == "search":
+        search(args, config)
+    elif args.command == "completion":
+        completion(args, config)
     else:
         parser.print_help()
 
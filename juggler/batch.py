@@ -0,0 +1,126 @@
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Any, Dict, Iterator, List, Set
+from juggler.template import Context, Template
+
+
+class BatchItem(BaseModel):
+    """
+    One independent template run. File items are read only when the
+    item is processed.
+    """
+
+    id: str
+    path: str = ""
+    variables: Dict[str, Any] = {}
+    inputs: List[str] = []
+    # why the item cannot be run, reported as its result
+    error: str = ""
+
+
+def read_items(files: List[str], jsonl: bool) -> Iterator[BatchItem]:
+    """
+    One item per input file, or one item per record when `jsonl` is set.
+    Record fields become template variables and the raw line is the
+    template input.
+    """
+
+    for fname in files:
+        if not jsonl:
+            yield BatchItem(id=fname, path=fname)
+            continue
+
+        with open(fname, "r") as f:
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield BatchItem(id=f"{fname}:{i + 1}", error=repr(e))
+                    continue
+                variables = record if isinstance(record, dict) else {}
+                item_id = str(variables.get("id", f"{fname}:{i + 1}"))
+                yield BatchItem(id=item_id, variables=variables, inputs=[line])
+
+
+def completed_items(output: Path) -> Set[str]:
+    """
+    Ids already processed successfully in a previous run.
+    """
+
+    done: Set[str] = set()
+    if not output.exists():
+        return done
+
+    with output.open("r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # partially written line from an interrupted run
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+async def run_item(
+    template: Template, context: Context, item: BatchItem
+) -> Dict[str, Any]:
+    if item.error:
+        return {"id": item.id, "status": "error", "error": item.error, "elapsed": 0}
+
+    start = time.monotonic()
+    try:
+        inputs = item.inputs
+        if item.path:
+            inputs = [Path(item.path).read_text()]
+        chat = await template.arun(context, inputs, item.variables)
+        result = {"id": item.id, "status": "ok", "output": chat.messages[-1].content}
+    except Exception as e:
+        result = {"id": item.id, "status": "error", "error": repr(e)}
+    result["elapsed"] = round(time.monotonic() - start, 3)
+    return result
+
+
+async def run_batch(
+    template: Template,
+    context: Context,
+    items: Iterator[BatchItem],
+    output: Path,
+    concurrency: int,
+) -> None:
+    """
+    Run a quiet template for every item with at most `concurrency` requests
+    in flight. Results are appended to `output` as JSON lines as soon as
+    they finish, and items already completed there are skipped, so an
+    interrupted batch can be resumed.
+    """
+
+    done = completed_items(output)
+    pending = (item for item in items if item.id not in done)
+    counts = {"ok": 0, "error": 0}
+
+    with output.open("a") as out:
+
+        async def worker() -> None:
+            # items are pulled lazily, the iterator is shared by workers
+            for item in pending:
+                result = await run_item(template, context, item)
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[result["status"]] += 1
+                print(f"batch: {item.id} {result['status']}", file=sys.stderr)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    print(
+        f"batch: {counts['ok']} ok, {counts['error']} errors,"
+        f" {len(done)} skipped",
+        file=sys.stderr,
+    )
@@ -0,0 +1,124 @@
+import hashlib
+import orjson
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class ResponseCache:
+    """
+    Streamed completions stored by (model, messages, parameters). Entries
+    expire after `ttl` seconds and the least recently used ones are
+    evicted once the cache grows over `max_bytes`. Hit and miss counters
+    are persisted together with the entries.
+    """
+
+    def __init__(self, path: Path, ttl: int, max_bytes: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL,
+                size INTEGER NOT NULL,
+                chunks TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+
+    @staticmethod
+    def key(model: str, messages: List[dict], params: Dict[str, Any]) -> str:
+        normalized = [
+            {k: v.strip() if isinstance(v, str) else v for k, v in m.items()}
+            for m in messages
+        ]
+        raw = orjson.dumps(
+            {"model": model, "messages": normalized, "params": params},
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.sha256(raw).hexdigest()
+
+    def _count(self, name: str) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO stats (name, value) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1
+            """,
+            (name,),
+        )
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """
+        Return the chunks of a cached response, or None on a miss.
+        """
+
+        now = time.time()
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT chunks FROM responses WHERE key = ? AND created > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self._count("hits")
+        return orjson.loads(row[0])
+
+    def put(self, key: str, model: str, chunks: List[str]) -> None:
+        now = time.time()
+        data = orjson.dumps(chunks)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, now, now, len(data), data.decode("utf8")),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self.conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        (total,) = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed")
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self) -> Dict[str, int]:
+        result = dict(self.conn.execute("SELECT name, value FROM stats"))
+        entries, size = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        return {
+            "hits": result.get("hits", 0),
+            "misses": result.get("misses", 0),
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self) -> None:
+        with self.conn:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.execute("DELETE FROM stats")
@@ -0,0 +1,114 @@
+import logging
+import re
+from pathlib import Path
+from pydantic import BaseModel, ValidationError
+from typing import Dict, List, Optional
+
+# entries with format {# summary: text #}
+SUMMARY_PATTERN = re.compile(r"{#[\s]+summary:[\s]+(.*)[\s]*#}")
+
+
+class TemplateEntry(BaseModel):
+    name: str
+    path: str
+    summary: str = ""
+    variables: List[str] = []
+    mtime: float
+
+
+class CatalogDir(BaseModel):
+    mtime: Optional[float] = None
+    templates: Dict[str, TemplateEntry] = {}
+
+
+class CatalogData(BaseModel):
+    dirs: Dict[str, CatalogDir] = {}
+
+
+def scan_template(path: Path, mtime: float) -> TemplateEntry:
+    # jinja is only needed when a template changed
+    from juggler.template import create_environment, split_prompt, undeclared
+
+    content = path.read_text()
+    summary = "".join(m.strip() for m in SUMMARY_PATTERN.findall(content))
+
+    env = create_environment()
+    variables = set()
+    for source in split_prompt(content):
+        variables |= undeclared(env, source)
+
+    return TemplateEntry(
+        name=path.stem,
+        path=str(path),
+        summary=summary,
+        variables=sorted(variables),
+        mtime=mtime,
+    )
+
+
+class TemplateCatalog:
+    """
+    Manifest of the templates found in a list of directories, persisted
+    as JSON. A directory is rescanned only when its mtime changed, which
+    happens when templates are added, removed or replaced, and inside it
+    only templates with a new mtime are read again. Lookups by name use
+    an in-memory index where the first directory wins.
+    """
+
+    def __init__(self, dirs: List[Path], path: Path):
+        self.dirs = dirs
+        self.path = path
+        self.data = CatalogData()
+        if path.exists():
+            try:
+                self.data = CatalogData.model_validate_json(path.read_text())
+            except ValidationError:
+                logging.warning("rebuilding invalid template catalog %s", path)
+        self.index: Dict[str, TemplateEntry] = {}
+        self.refresh()
+
+    def _scan_dir(self, d: Path, mtime: Optional[float]) -> CatalogDir:
+        previous = self.data.dirs.get(str(d), CatalogDir())
+        templates = {}
+        if mtime is not None:
+            for f in sorted(d.glob("*.j2")):
+                file_mtime = f.stat().st_mtime
+                entry = previous.templates.get(f.stem)
+                if entry is None or entry.mtime != file_mtime:
+                    entry = scan_template(f, file_mtime)
+                templates[f.stem] = entry
+        return CatalogDir(mtime=mtime, templates=templates)
+
+    def refresh(self) -> None:
+        changed = False
+        for d in self.dirs:
+            try:
+                mtime: Optional[float] = d.stat().st_mtime
+            except FileNotFoundError:
+                mtime = None
+            cached = self.data.dirs.get(str(d))
+            if cached is None or cached.mtime != mtime:
+                self.data.dirs[str(d)] = self._scan_dir(d, mtime)
+                changed = True
+
+        self.index = {}
+        for d in reversed(self.dirs):
+            self.index.update(self.data.dirs[str(d)].templates)
+
+        if changed:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(self.data.model_dump_json())
+            tmp.replace(self.path)
+
+    def get(self, name: str) -> Optional[TemplateEntry]:
+        return self.index.get(name)
+
+    def entries(self) -> List[TemplateEntry]:
+        return sorted(self.index.values(), key=lambda e: e.name)
+
+    def print(self, names_only: bool = False) -> None:
+        for entry in self.entries():
+            if names_only or entry.summary == "":
+                print(entry.name)
+            else:
+                print(f"{entry.name}: {entry.summary}")
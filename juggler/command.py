@@ -0,0 +1,277 @@
+import os
+import secrets
+import selectors
+import signal
+import subprocess
+import sys
+import time
+from typing import BinaryIO, Callable, List, Optional
+
+# seconds given to a command to exit after SIGTERM before SIGKILL
+KILL_GRACE = 2.0
+
+
+class CappedOutput:
+    """
+    Keep the first and last `max_bytes / 2` bytes of a stream and count
+    the bytes dropped in between, so memory stays bounded whatever the
+    command prints.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.head_bytes = max_bytes // 2
+        self.tail_bytes = max_bytes - self.head_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.omitted = 0
+
+    def write(self, data: bytes) -> None:
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        overflow = len(self.tail) - self.tail_bytes
+        if overflow > 0:
+            del self.tail[:overflow]
+            self.omitted += overflow
+
+    def text(self) -> str:
+        head = self.head.decode("utf8", errors="replace")
+        tail = self.tail.decode("utf8", errors="replace")
+        if self.omitted == 0:
+            return head + tail
+        return f"{head}\n[... {self.omitted} bytes omitted ...]\n{tail}"
+
+
+class CommandResult:
+    def __init__(
+        self,
+        output: str,
+        exit_code: Optional[int],
+        timed_out: bool = False,
+        interrupted: bool = False,
+        restarted: bool = False,
+    ):
+        self.output = output
+        self.exit_code = exit_code
+        self.timed_out = timed_out
+        self.interrupted = interrupted
+        # the shell session was lost with its directory and variables
+        self.restarted = restarted
+
+    def status(self, timeout: float) -> str:
+        if self.timed_out:
+            status = f"killed after the {timeout:g}s timeout"
+        elif self.interrupted:
+            status = "interrupted by the user"
+        else:
+            status = f"exit status {self.exit_code}"
+        if self.restarted:
+            status += ", the shell session was restarted"
+        return status
+
+    def summary(self, timeout: float) -> str:
+        """
+        Output and outcome of the command as added to the conversation.
+        """
+
+        return f"{self.output.strip()}\n\n[{self.status(timeout)}]".strip()
+
+
+# shells understanding the POSIX syntax used to wrap commands
+POSIX_SHELLS = ("sh", "bash", "dash", "ksh", "zsh")
+
+
+def shell_path() -> str:
+    shell = os.environ.get("SHELL", "/bin/sh")
+    if os.path.basename(shell) in POSIX_SHELLS:
+        return shell
+    return "/bin/sh"
+
+
+class Sentinel:
+    """
+    Split a stream at the end of command marker. Bytes that may be the
+    start of the marker are held back until the next chunk, bytes after
+    the marker are kept in `rest`.
+    """
+
+    def __init__(self, marker: bytes):
+        self.marker = marker
+        self.pending = b""
+        self.found = False
+        self.rest = b""
+
+    def feed(self, data: bytes) -> bytes:
+        if self.found:
+            self.rest += data
+            return b""
+        data = self.pending + data
+        i = data.find(self.marker)
+        if i >= 0:
+            self.found = True
+            self.pending = b""
+            self.rest = data[i + len(self.marker) :]
+            return data[:i]
+        for n in range(min(len(self.marker) - 1, len(data)), 0, -1):
+            if self.marker.startswith(data[-n:]):
+                self.pending = data[-n:]
+                return data[:-n]
+        self.pending = b""
+        return data
+
+    def flush(self) -> bytes:
+        data, self.pending = self.pending, b""
+        return data
+
+
+def pump(
+    streams: List[BinaryIO],
+    deadline: float,
+    on_output: Callable[[BinaryIO, bytes], bool],
+) -> bool:
+    """
+    Forward chunks read from `streams` to `on_output` as they arrive,
+    an empty chunk at end of file. A stream is no longer read once
+    `on_output` returns true for it or it is closed. Return false if
+    the deadline passes first.
+    """
+
+    with selectors.DefaultSelector() as sel:
+        for s in streams:
+            sel.register(s, selectors.EVENT_READ)
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            for key, _ in sel.select(remaining):
+                data = os.read(key.fd, 65536)
+                if on_output(key.fileobj, data) or not data:  # pyright: ignore
+                    sel.unregister(key.fileobj)
+    return True
+
+
+def kill(p: subprocess.Popen) -> None:
+    # the shell runs in its own session, signal the whole group
+    for sig, wait in ((signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, None)):
+        try:
+            os.killpg(p.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            p.wait(wait)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+class ShellSession:
+    """
+    Long lived shell running commands one after the other, so the
+    working directory and variables carry over between them. After each
+    command the shell prints a marker with the exit status on stdout
+    and the marker on stderr, which tells when its output is complete.
+    A command timing out or interrupted kills the shell, which is
+    started again for the next one.
+    """
+
+    def __init__(self, shell: Optional[str] = None):
+        self.shell = shell or shell_path()
+        self.marker = f"__juggler_{secrets.token_hex(8)}__"
+        self.proc: Optional[subprocess.Popen] = None
+
+    def _start(self) -> subprocess.Popen:
+        if self.proc is not None and self.proc.poll() is not None:
+            self.close()
+        if self.proc is None:
+            self.proc = subprocess.Popen(
+                [self.shell],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        return self.proc
+
+    def _script(self, cmd: str) -> bytes:
+        # braces keep the command in the shell process, commands reading
+        # their input get /dev/null instead of the rest of the script
+        return (
+            f"{{ {cmd.strip() or ':'}\n}} </dev/null\n"
+            f"printf '%s%d\\n' {self.marker} \"$?\"\n"
+            f"printf '%s\\n' {self.marker} >&2\n"
+        ).encode("utf8")
+
+    def run(
+        self, cmd: str, timeout: float, max_bytes: int, echo: bool = True
+    ) -> CommandResult:
+        """
+        Run `cmd` in the session, echoing its output to the terminal
+        while it runs. The command is killed after `timeout` seconds or
+        on Ctrl-C, and at most `max_bytes` of output are kept.
+        """
+
+        p = self._start()
+        assert p.stdin is not None and p.stdout is not None and p.stderr is not None
+        marker = self.marker.encode("utf8")
+        sentinels = {p.stdout: Sentinel(marker), p.stderr: Sentinel(marker)}
+        captured = CappedOutput(max_bytes)
+
+        def on_output(stream: BinaryIO, data: bytes) -> bool:
+            sentinel = sentinels[stream]
+            out = sentinel.feed(data) if data else sentinel.flush()
+            if out:
+                captured.write(out)
+                if echo:
+                    terminal = sys.stdout if stream is p.stdout else sys.stderr
+                    terminal.buffer.write(out)
+                    terminal.flush()
+            # stdout is complete once the exit status follows the marker
+            return sentinel.found and (stream is p.stderr or b"\n" in sentinel.rest)
+
+        deadline = time.monotonic() + timeout
+        finished = interrupted = False
+        try:
+            p.stdin.write(self._script(cmd))
+            p.stdin.flush()
+            finished = pump([p.stdout, p.stderr], deadline, on_output)
+        except BrokenPipeError:
+            # the shell is gone, reported below as its exit
+            finished = True
+        except KeyboardInterrupt:
+            interrupted = True
+
+        status = sentinels[p.stdout]
+        if finished and status.found:
+            exit_code: Optional[int] = int(status.rest.split(b"\n")[0])
+        else:
+            # killed, or the command made the shell exit
+            if not finished:
+                kill(p)
+            exit_code = p.wait()
+            self.close()
+        return CommandResult(
+            captured.text(),
+            exit_code,
+            timed_out=not finished and not interrupted,
+            interrupted=interrupted,
+            restarted=self.proc is None,
+        )
+
+    def close(self) -> None:
+        if self.proc is None:
+            return
+        p, self.proc = self.proc, None
+        assert p.stdin is not None and p.stdout is not None and p.stderr is not None
+        if p.poll() is None:
+            try:
+                p.stdin.close()
+                p.wait(KILL_GRACE)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                kill(p)
+        for f in (p.stdin, p.stdout, p.stderr):
+            try:
+                f.close()
+            except BrokenPipeError:
+                pass
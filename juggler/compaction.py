@@ -0,0 +1,128 @@
+from typing import List, Optional
+from juggler.llm import astream
+from juggler.message import Chat, Message, MessageType
+
+SUMMARY_PROMPT = """Summarize the conversation below so that it can be continued without it. Keep facts, decisions, names of files and commands, their outcomes and open questions. Be concise and only return the summary.
+"""
+
+
+def estimate_tokens(msg: Message) -> int:
+    # about four characters per token plus the message framing, exact
+    # counts would tokenize the whole history on every turn
+    return len(msg.content) // 4 + 4
+
+
+class Compactor:
+    """
+    Bound the history sent with each turn. Leading system messages are
+    always sent, then the most recent messages that fit in `max_tokens`,
+    at most `keep_last` of them. With `summarize` the messages left out
+    are folded into a rolling summary that is sent in their place;
+    `compact` updates it and can run in the background. The chat itself
+    keeps every message.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        keep_last: int,
+        summarize: bool = False,
+        model: Optional[str] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.keep_last = keep_last
+        self.summarize = summarize
+        self.model = model
+
+    def _head(self, chat: Chat) -> int:
+        head = 0
+        while (
+            head < len(chat.messages)
+            and chat.messages[head].msg_type == MessageType.SYSTEM
+        ):
+            head += 1
+        return head
+
+    def _window(self, chat: Chat) -> int:
+        """
+        Index of the first message sent verbatim after the head.
+        """
+
+        head = self._head(chat)
+        budget = self.max_tokens - sum(estimate_tokens(m) for m in chat.messages[:head])
+        if chat.summary:
+            budget -= len(chat.summary) // 4
+
+        start = len(chat.messages)
+        used = 0
+        while start > head and len(chat.messages) - start < self.keep_last:
+            tokens = estimate_tokens(chat.messages[start - 1])
+            # the last message is always sent
+            if used + tokens > budget and start < len(chat.messages):
+                break
+            used += tokens
+            start -= 1
+
+        # providers expect the conversation to resume with a user turn
+        while start < len(chat.messages) - 1 and chat.messages[start].msg_type == (
+            MessageType.AI
+        ):
+            start += 1
+        return start
+
+    def messages(self, chat: Chat, cache_control: bool = False) -> List[dict]:
+        """
+        Messages to send for the next turn.
+        """
+
+        head = self._head(chat)
+        start = self._window(chat)
+        if start == head:
+            return chat.to_dict(cache_control)
+
+        messages = chat.messages[:head]
+        if self.summarize and chat.summary:
+            messages.append(
+                Message(
+                    msg_type=MessageType.SYSTEM,
+                    content=f"Summary of the earlier conversation:\n\n{chat.summary}",
+                )
+            )
+        messages.extend(chat.messages[start:])
+        return Chat(messages=messages).to_dict(cache_control)
+
+    def pending(self, chat: Chat) -> bool:
+        """
+        Whether messages outside the window are not summarized yet.
+        """
+
+        return self.summarize and self._window(chat) > max(
+            chat.summarized, self._head(chat)
+        )
+
+    async def compact(self, chat: Chat, model: str) -> None:
+        """
+        Fold the messages that left the window into the chat summary.
+        """
+
+        if not self.pending(chat):
+            return
+
+        start = max(chat.summarized, self._head(chat))
+        end = self._window(chat)
+        transcript = "\n\n".join(
+            f"{m.msg_type.to_role()}: {m.content}" for m in chat.messages[start:end]
+        )
+        if chat.summary:
+            transcript = f"Earlier summary:\n\n{chat.summary}\n\n{transcript}"
+
+        summary = ""
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ]
+        async for content in astream(self.model or model, messages, "compaction"):
+            summary += content
+
+        chat.summary = summary.strip()
+        chat.summarized = end
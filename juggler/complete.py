@@ -1,41 +1,140 @@
+import mmap
 import sys
+import time
 import pathlib
-from litellm import completion
+from types import TracebackType
+from typing import List, Optional, Tuple, Type
+from juggler.llm import stream
 from juggler.message import Chat, Message, MessageType
 
+# bytes from the end of the file sent to the model
+TAIL_BYTES = 16 * 1024
+# appended output is flushed when either threshold is reached
+FLUSH_BYTES = 4096
+FLUSH_INTERVAL = 0.5
 
-def complete(model: str, fname: pathlib.Path) -> None:
-    with open(fname, "r") as f:
-        content = f.read()
 
-    with open(fname, "a") as f:
-        chat = Chat()
-        chat.add_message(
-            Message(
-                msg_type=MessageType.SYSTEM,
-                content="""
+def read_window(
+    fname: pathlib.Path, head_bytes: int, tail_bytes: int
+) -> Tuple[str, int, str]:
+    """
+    Read the first `head_bytes` and the last `tail_bytes` of a file, cut
+    at line boundaries, and return them with the number of bytes left
+    out in between. Small files are returned whole as tail.
+    """
+
+    size = fname.stat().st_size
+    if size == 0:
+        return "", 0, ""
+
+    with open(fname, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        if size <= head_bytes + tail_bytes:
+            return "", 0, m[:].decode("utf8", errors="replace")
+
+        head_end = 0
+        if head_bytes > 0:
+            newline = m.rfind(b"\n", 0, head_bytes)
+            head_end = newline + 1 if newline != -1 else head_bytes
+        # a newline ending the file would leave an empty tail
+        newline = m.find(b"\n", size - tail_bytes)
+        if newline != -1 and newline + 1 < size:
+            tail_start = newline + 1
+        else:
+            tail_start = size - tail_bytes
+
+        # cuts may split a character, drop the partial bytes
+        head = m[:head_end].decode("utf8", errors="ignore")
+        tail = m[tail_start:].decode("utf8", errors="ignore")
+        return head, tail_start - head_end, tail
+
+
+class AppendWriter:
+    """
+    Append streamed text to a file, flushing every `flush_bytes` or
+    `flush_interval` seconds instead of on every delta. If the stream
+    is interrupted the file is truncated back to its original size, so
+    it never ends with a partial completion.
+    """
+
+    def __init__(self, fname: pathlib.Path, flush_bytes: int, flush_interval: float):
+        self.fname = fname
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.buffer: List[bytes] = []
+        self.buffered = 0
+
+    def __enter__(self) -> "AppendWriter":
+        self.f = open(self.fname, "ab")
+        self.start = self.f.tell()
+        self.flushed = time.monotonic()
+        return self
+
+    def write(self, text: str) -> None:
+        data = text.encode("utf8")
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if (
+            self.buffered >= self.flush_bytes
+            or time.monotonic() - self.flushed >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        self.f.write(b"".join(self.buffer))
+        self.f.flush()
+        self.buffer = []
+        self.buffered = 0
+        self.flushed = time.monotonic()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType],
+    ) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            self.f.truncate(self.start)
+        self.f.close()
+
+
+def complete(
+    model: str,
+    fname: pathlib.Path,
+    head_bytes: int = 0,
+    tail_bytes: int = TAIL_BYTES,
+) -> None:
+    head, omitted, tail = read_window(fname, head_bytes, tail_bytes)
+    content = tail
+    if omitted > 0:
+        content = f"{head}\n[... {omitted} bytes omitted ...]\n{tail}"
+
+    chat = Chat()
+    chat.add_message(
+        Message(
+            msg_type=MessageType.SYSTEM,
+            content="""
 You are a specialist in programming, your job is to expand the provided content. No aditional content or markdown should be provided, only respond with the incremental content.
 
 # Instructions
 
 - Do not add markdown or triple quotes
 - Only return the content that should be appended to file
+- Parts of a long file may be omitted, continue from the end of the content
 """,
-            )
         )
+    )
 
-        chat.add_message(
-            Message(
-                msg_type=MessageType.USER,
-                content=content,
-            )
+    chat.add_message(
+        Message(
+            msg_type=MessageType.USER,
+            content=content,
         )
-        print(content)
-
-        resp = completion(model=model, messages=chat.to_dict(), stream=True)
-        for part in resp:
-            content = part.choices[0].delta.content  # pyright: ignore
-            if content is not None:
-                sys.stdout.write(content)
-                f.write(content)
-                f.flush()
+    )
+    print(tail)
+
+    with AppendWriter(fname, FLUSH_BYTES, FLUSH_INTERVAL) as f:
+        for content in stream(model, chat.to_dict(), "complete"):
+            sys.stdout.write(content)
+            f.write(content)
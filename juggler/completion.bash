@@ -0,0 +1,26 @@
+# bash completion for juggler, enable with:
+#   eval "$(juggler completion)"
+# template names are read from the template catalog
+
+_juggler() {
+    local cur="${COMP_WORDS[COMP_CWORD]}"
+    local command=""
+    local i
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        case "${COMP_WORDS[i]}" in
+            --model) ((i++)) ;;
+            -*) ;;
+            *) command="${COMP_WORDS[i]}"; break ;;
+        esac
+    done
+
+    if [[ -z "$command" ]]; then
+        COMPREPLY=($(compgen -W "list tui run batch complete shell cache stats search completion --model --no-cache" -- "$cur"))
+    elif [[ "$command" == "run" || "$command" == "batch" ]] && [[ "$cur" != -* ]]; then
+        local names
+        names="$("${COMP_WORDS[0]}" list --names 2>/dev/null)"
+        COMPREPLY=($(compgen -W "$names" -- "$cur"))
+    fi
+}
+
+complete -o default -F _juggler juggler
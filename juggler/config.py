@@ -1,6 +1,6 @@
 import yaml
 import logging
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from pathlib import Path
 
@@ -21,11 +21,66 @@ class GeminiConfig(BaseModel):
     key: str
 
 
+class CacheConfig(BaseModel):
+    enabled: bool = False
+    # seconds a response stays valid
+    ttl: int = 7 * 24 * 60 * 60
+    max_bytes: int = 64 * 1024 * 1024
+
+
+class TemplatesConfig(BaseModel):
+    # persist compiled templates in ~/.cache/juggler/jinja
+    bytecode_cache: bool = False
+
+
+class RoutingConfig(BaseModel):
+    # name usable as --model -> equivalent models, the fastest is used
+    groups: Dict[str, List[str]] = {}
+    # seconds without a first token before the next model is also tried
+    hedge_after: Optional[float] = None
+
+
+class TelemetryConfig(BaseModel):
+    # record every request in ~/.cache/juggler/telemetry.db
+    enabled: bool = True
+    # Prometheus textfile rewritten after each request
+    prometheus: Optional[str] = None
+
+
+class CompactionConfig(BaseModel):
+    # bound the history sent by the TUI and the shell agent
+    enabled: bool = True
+    # estimated tokens of history sent with each turn
+    max_tokens: int = 16000
+    # most recent messages sent verbatim
+    keep_last: int = 20
+    # fold older messages into a rolling summary instead of dropping them,
+    # off by default as it calls the model in the background
+    summarize: bool = False
+    # model writing the summary, defaults to the chat model
+    model: Optional[str] = None
+
+
 class Config(BaseModel):
     openai: Optional[OpenAIConfig]
     anthropic: Optional[AnthropicConfig]
     deepseek: Optional[DeepseekConfig]
     gemini: Optional[GeminiConfig]
+    cache: CacheConfig = CacheConfig()
+    templates: TemplatesConfig = TemplatesConfig()
+    routing: RoutingConfig = RoutingConfig()
+    telemetry: TelemetryConfig = TelemetryConfig()
+    compaction: CompactionConfig = CompactionConfig()
+
+
+def cache_dir() -> Path:
+    """
+    Directory for data that can be rebuilt, like token counts.
+    """
+
+    path = Path.home().joinpath(".cache/juggler")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
 
 
 def read_config() -> Config:
@@ -0,0 +1,289 @@
+import fnmatch
+import glob
+import mmap
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, Iterator, List, Optional, Tuple
+from juggler.model import ContextFile
+
+# files larger than this are read through mmap, below the default
+# max_file_bytes so that mapping is actually used
+MMAP_THRESHOLD = 64 * 1024
+# bytes inspected when looking for binary content
+BINARY_PROBE = 8192
+
+
+class SkippedFile(BaseModel):
+    filename: str
+    reason: str
+
+
+class ContextReport(BaseModel):
+    files: List[ContextFile] = []
+    skipped: List[SkippedFile] = []
+    total_bytes: int = 0
+    # filled when files are packed into a token budget
+    total_tokens: Optional[int] = None
+
+    def print(self) -> None:
+        """
+        Print included and skipped files to stderr, keeping stdout for
+        the template output.
+        """
+
+        for f in self.files:
+            print(f"context: + {f.filename}", file=sys.stderr)
+        for s in self.skipped:
+            print(f"context: - {s.filename} ({s.reason})", file=sys.stderr)
+        tokens = "" if self.total_tokens is None else f", {self.total_tokens} tokens"
+        print(
+            f"context: {len(self.files)} files, {self.total_bytes} bytes{tokens},"
+            f" {len(self.skipped)} skipped",
+            file=sys.stderr,
+        )
+
+
+class IgnoreRules:
+    """
+    Subset of .gitignore semantics: comments, negation, directory only
+    patterns and anchored patterns. Rules from every .gitignore between
+    the repository root and a file are applied, deepest last.
+    """
+
+    def __init__(self, base: Path):
+        base = base.absolute()
+        # repository containing base, or base itself outside of git
+        self.root = next(
+            (d for d in [base, *base.parents] if d.joinpath(".git").exists()), base
+        )
+        self._rules: Dict[Path, List[Tuple[str, bool, bool, bool]]] = {}
+        self._dirs: Dict[Path, bool] = {}
+
+    def _load(self, directory: Path) -> List[Tuple[str, bool, bool, bool]]:
+        if directory in self._rules:
+            return self._rules[directory]
+
+        rules = []
+        path = directory.joinpath(".gitignore")
+        if path.is_file():
+            for line in path.read_text(errors="ignore").splitlines():
+                line = line.rstrip()
+                if not line or line.startswith("#"):
+                    continue
+                negate = line.startswith("!")
+                line = line.lstrip("!")
+                dir_only = line.endswith("/")
+                line = line.rstrip("/")
+                anchored = "/" in line
+                rules.append((line.lstrip("/"), negate, dir_only, anchored))
+        self._rules[directory] = rules
+        return rules
+
+    def ignored(self, path: Path, is_dir: bool) -> bool:
+        path = path.absolute()
+        if path.name == ".git":
+            return True
+
+        result = False
+        for directory in reversed(path.parents):
+            if directory != self.root and self.root not in directory.parents:
+                continue
+            rel = path.relative_to(directory).as_posix()
+            for pattern, negate, dir_only, anchored in self._load(directory):
+                if dir_only and not is_dir:
+                    continue
+                target = rel if anchored else path.name
+                if fnmatch.fnmatch(target, pattern):
+                    result = not negate
+        return result
+
+    def ignored_dir(self, directory: Path) -> bool:
+        """
+        Whether directory or one of its parents below the root is
+        ignored. Files in an ignored directory cannot be included again.
+        """
+
+        directory = directory.absolute()
+        if directory not in self._dirs:
+            inside = directory != self.root and self.root in directory.parents
+            self._dirs[directory] = inside and (
+                self.ignored_dir(directory.parent) or self.ignored(directory, True)
+            )
+        return self._dirs[directory]
+
+
+def _walk(root: Path, rules: IgnoreRules) -> Iterator[Path]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        base = Path(dirpath)
+        dirnames[:] = sorted(
+            d for d in dirnames if not rules.ignored(base.joinpath(d), True)
+        )
+        for name in sorted(filenames):
+            path = base.joinpath(name)
+            if not rules.ignored(path, False):
+                yield path
+
+
+def base_dir(pattern: str) -> Path:
+    """
+    Leading part of pattern without glob wildcards.
+    """
+
+    parts = []
+    for part in Path(pattern).parts:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return Path(*parts) if parts else Path(".")
+
+
+def expand(pattern: str, rules: IgnoreRules) -> Iterator[Path]:
+    """
+    Expand a directory or a glob pattern (`**` is recursive) into files
+    that are not ignored.
+    """
+
+    if os.path.isdir(pattern):
+        yield from _walk(Path(pattern), rules)
+        return
+
+    for name in sorted(glob.iglob(pattern, recursive=True)):
+        path = Path(name)
+        if (
+            path.is_file()
+            and not rules.ignored_dir(path.parent)
+            and not rules.ignored(path, False)
+        ):
+            yield path
+
+
+def unreadable(error: OSError) -> str:
+    return f"unreadable: {error.strerror or error}"
+
+
+def probe(path: Path, max_file_bytes: int) -> Tuple[int, Optional[str]]:
+    """
+    Size of file and the reason to skip it, if any. Only the first
+    bytes are read to detect binary content.
+    """
+
+    try:
+        size = path.stat().st_size
+        if size > max_file_bytes:
+            return size, "too large"
+        with open(path, "rb") as f:
+            if b"\0" in f.read(BINARY_PROBE):
+                return size, "binary"
+    except OSError as e:
+        return 0, unreadable(e)
+    return size, None
+
+
+def read_text(path: Path, size: int) -> Optional[str]:
+    """
+    Read file as text, returning None for binary content.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            if size < MMAP_THRESHOLD:
+                data = f.read()
+                if b"\0" in data[:BINARY_PROBE]:
+                    return None
+                return data.decode("utf8")
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if m.find(b"\0", 0, BINARY_PROBE) >= 0:
+                    return None
+                # decode from the mapping without copying it into bytes
+                with memoryview(m) as view:
+                    return str(view, "utf8")
+    except UnicodeDecodeError:
+        return None
+
+
+def load_text(path: Path, size: int) -> Tuple[Optional[str], str]:
+    """
+    Content of file, or None and the reason it could not be read.
+    """
+
+    try:
+        content = read_text(path, size)
+    except OSError as e:
+        return None, unreadable(e)
+    return content, "binary"
+
+
+def load_context(
+    pattern: str,
+    max_file_bytes: int,
+    max_total_bytes: int,
+    workers: int = 8,
+) -> ContextReport:
+    """
+    Load context files matching pattern. Files are probed for binary
+    content, selected in path order until the total byte budget is used,
+    then read concurrently. Only the files included as text count
+    against the budget.
+    """
+
+    rules = IgnoreRules(base_dir(pattern))
+    report = ContextReport()
+    paths: List[Path] = []
+    seen = set()
+
+    for path in expand(pattern, rules):
+        real = path.resolve()
+        if real not in seen:
+            seen.add(real)
+            paths.append(path)
+
+    # path index, path and size of the files left to budget
+    candidates: List[Tuple[int, Path, int]] = []
+    included: List[Tuple[int, ContextFile]] = []
+    total = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        probes = pool.map(lambda path: probe(path, max_file_bytes), paths)
+        for index, (path, (size, reason)) in enumerate(zip(paths, probes)):
+            if reason is not None:
+                report.skipped.append(SkippedFile(filename=str(path), reason=reason))
+            else:
+                candidates.append((index, path, size))
+
+        while candidates:
+            selected, over = [], []
+            for entry in candidates:
+                if total + entry[2] > max_total_bytes:
+                    over.append(entry)
+                else:
+                    selected.append(entry)
+                    total += entry[2]
+
+            freed = False
+            contents = pool.map(lambda entry: load_text(*entry[1:]), selected)
+            for (index, path, size), (content, reason) in zip(selected, contents):
+                if content is None:
+                    skipped = SkippedFile(filename=str(path), reason=reason)
+                    report.skipped.append(skipped)
+                    total -= size
+                    freed = True
+                else:
+                    included.append(
+                        (index, ContextFile(filename=str(path), content=content))
+                    )
+
+            # files that turned out not to be text left room for others
+            candidates = over if freed else []
+            if not freed:
+                for _, path, _ in over:
+                    report.skipped.append(
+                        SkippedFile(filename=str(path), reason="total limit")
+                    )
+
+    report.files = [f for _, f in sorted(included, key=lambda entry: entry[0])]
+    report.total_bytes = total
+    return report
@@ -0,0 +1,414 @@
+"""
+Streaming completions shared by templates, complete, the shell agent and
+the TUI. Callers iterate text deltas; whether they come from the
+provider, from which model of a routing group, or from the response
+cache is transparent to them.
+"""
+
+import asyncio
+import functools
+import logging
+import orjson
+import sys
+import time
+from pydantic import BaseModel
+from typing import (
+    Any,
+    AsyncIterator,
+    Coroutine,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+from juggler import pool
+from juggler.cache import ResponseCache
+from juggler.routing import Router
+from juggler.telemetry import RequestRecord, Telemetry
+
+# providers that only cache prompt prefixes marked with cache_control,
+# the others cache long prefixes automatically
+EXPLICIT_CACHE_PROVIDERS = {"anthropic"}
+
+T = TypeVar("T")
+
+
+class Usage(BaseModel):
+    """
+    Tokens used by the requests sent to providers in this process.
+    """
+
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+
+    def add(self, usage: Any) -> None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.requests += 1
+        self.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        self.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+        self.cache_read_tokens += getattr(details, "cached_tokens", 0) or 0
+        self.cache_write_tokens += getattr(usage, "cache_creation_input_tokens", 0) or 0
+
+    def merge(self, other: "Usage") -> None:
+        for name, value in other:
+            setattr(self, name, getattr(self, name) + value)
+
+    def print(self) -> None:
+        if self.requests == 0:
+            return
+        print(
+            f"usage: {self.requests} requests, {self.prompt_tokens} prompt tokens"
+            f" ({self.cache_read_tokens} cache read,"
+            f" {self.cache_write_tokens} cache write),"
+            f" {self.completion_tokens} completion tokens",
+            file=sys.stderr,
+        )
+
+
+_cache: Optional[ResponseCache] = None
+_router: Optional[Router] = None
+_telemetry: Optional[Telemetry] = None
+_usage = Usage()
+# event loop used to drive `stream` from synchronous code
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# models whose endpoint rejected stream_options
+_no_stream_options: Set[str] = set()
+
+
+def configure(
+    cache: Optional[ResponseCache] = None,
+    router: Optional[Router] = None,
+    telemetry: Optional[Telemetry] = None,
+) -> None:
+    global _cache, _router, _telemetry
+    _cache = cache
+    _router = router
+    _telemetry = telemetry
+
+
+def usage() -> Usage:
+    return _usage
+
+
+@functools.lru_cache
+def cache_control(model: str) -> bool:
+    """
+    Whether cacheable messages must be marked for `model`, true for a
+    group if any of its models needs them.
+    """
+
+    if _router is not None and model in _router.groups:
+        return any(cache_control(m) for m in _router.groups[model])
+
+    from litellm import get_llm_provider
+    from litellm.utils import supports_prompt_caching
+
+    try:
+        provider = get_llm_provider(model)[1]
+        return provider in EXPLICIT_CACHE_PROVIDERS and supports_prompt_caching(model)
+    except Exception:
+        return False
+
+
+def stream_options(model: str) -> Dict[str, Any]:
+    """
+    Ask for the usage chunk at the end of the stream. litellm sends the
+    option only to providers that support it and counts usage itself
+    for the others, but OpenAI compatible endpoints may still reject
+    it; those models are then streamed without it.
+    """
+
+    if model in _no_stream_options:
+        return {}
+    return {"stream_options": {"include_usage": True}}
+
+
+def strip_cache_control(messages: List[dict]) -> List[dict]:
+    result = []
+    for m in messages:
+        if isinstance(m["content"], list):
+            text = "".join(part["text"] for part in m["content"])
+            m = {**m, "content": text}
+        result.append(m)
+    return result
+
+
+async def provider_stream(
+    model: str, messages: List[dict], params: Dict[str, Any], usage: Usage
+) -> AsyncIterator[str]:
+    """
+    Stream completion deltas from a single model, adding the tokens
+    reported at the end to `usage`.
+    """
+
+    from litellm import BadRequestError, acompletion
+
+    pool.install(model)
+    if not cache_control(model):
+        # markers may come from a group that includes other providers
+        messages = strip_cache_control(messages)
+    else:
+        # the list may be the one kept by a Chat, litellm gets its own
+        messages = list(messages)
+
+    # litellm streams do not close their response when they are stopped
+    # early, keep them to close the connection on cancellation
+    opened: List[Any] = []
+    token = pool.responses.set(opened)
+    try:
+        try:
+            resp = await acompletion(
+                model=model,
+                messages=messages,
+                stream=True,
+                **stream_options(model),
+                **params,
+            )
+        except BadRequestError as e:
+            if "stream_options" not in str(e) or model in _no_stream_options:
+                raise
+            logging.warning("%s rejected stream_options, usage is not counted", model)
+            _no_stream_options.add(model)
+            resp = await acompletion(
+                model=model, messages=messages, stream=True, **params
+            )
+    finally:
+        pool.responses.reset(token)
+
+    last_usage = None
+    try:
+        async for part in resp:  # pyright: ignore
+            # the usage chunk may come without choices
+            if getattr(part, "usage", None):
+                last_usage = part.usage
+            if not part.choices:
+                continue
+            content = part.choices[0].delta.content
+            if content is not None:
+                yield content
+    finally:
+        await pool.close(opened)
+
+    if last_usage is not None:
+        usage.add(last_usage)
+
+
+async def first_chunk(agen: AsyncIterator[str]) -> Optional[str]:
+    try:
+        return await agen.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def cancel_stream(task: asyncio.Future, agen: AsyncIterator[str]) -> None:
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await agen.aclose()  # pyright: ignore
+
+
+async def route(
+    router: Router,
+    model: str,
+    messages: List[dict],
+    params: Dict[str, Any],
+    usage: Usage,
+) -> Tuple[str, AsyncIterator[str], Optional[str]]:
+    """
+    Start streams on the candidates for `model` until one produces its
+    first chunk: the next candidate is started when the running ones
+    failed or, with hedging, when they are late. Losers are cancelled.
+    Return the winning model, its stream and the first chunk.
+    """
+
+    queue = router.candidates(model)
+    # first chunk task -> model, stream and start time
+    running: Dict[asyncio.Future, Tuple[str, AsyncIterator[str], float]] = {}
+    error: Optional[BaseException] = None
+
+    def start() -> None:
+        candidate = queue.pop(0)
+        agen = provider_stream(candidate, messages, params, usage)
+        task = asyncio.ensure_future(first_chunk(agen))
+        running[task] = (candidate, agen, time.monotonic())
+
+    start()
+    try:
+        while running:
+            timeout = router.hedge_after if queue else None
+            done, _ = await asyncio.wait(
+                running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                logging.info("hedging %s after %ss", model, timeout)
+                start()
+                continue
+
+            winner = None
+            for task in done:
+                candidate, agen, started = running.pop(task)
+                if task.exception() is not None:
+                    router.record_error(candidate)
+                    error = task.exception()
+                    logging.warning("%s failed: %r", candidate, error)
+                elif winner is None:
+                    router.record(candidate, time.monotonic() - started)
+                    winner = (candidate, agen, task.result())
+                else:
+                    await agen.aclose()  # pyright: ignore
+
+            if winner is not None:
+                for task, (candidate, agen, started) in running.items():
+                    # a lower bound of its latency, enough to rank it last
+                    router.record(candidate, time.monotonic() - started)
+                return winner
+            if not running and queue:
+                start()
+    finally:
+        # the losers, or every stream if the caller was cancelled
+        for task, (_, agen, _) in running.items():
+            await cancel_stream(task, agen)
+
+    assert error is not None
+    raise error
+
+
+async def astream(
+    model: str, messages: List[dict], tag: str = "", **params: Any
+) -> AsyncIterator[str]:
+    """
+    Stream completion deltas. `model` can name a routing group. A
+    response is cached only if the stream was consumed until the end.
+
+    Every request is measured and, with telemetry configured, recorded
+    under `tag`, the entry point or template making it.
+    """
+
+    usage = Usage()
+    record = RequestRecord(time=time.time(), model=model, served=model, tag=tag)
+    if _telemetry is not None:
+        record.prompt_bytes = len(orjson.dumps(messages))
+    start = last = time.monotonic()
+    gaps: List[float] = []
+    chunks = cached_stream(model, messages, params, record, usage)
+    try:
+        async for chunk in chunks:
+            now = time.monotonic()
+            if record.ttft is None:
+                record.ttft = now - start
+            else:
+                gaps.append(now - last)
+            last = now
+            record.response_bytes += len(chunk.encode("utf8"))
+            yield chunk
+    except (GeneratorExit, asyncio.CancelledError):
+        record.status = "cancelled"
+        raise
+    except Exception:
+        record.status = "error"
+        raise
+    finally:
+        await chunks.aclose()  # pyright: ignore
+        _usage.merge(usage)
+        if _telemetry is not None:
+            record.latency = time.monotonic() - start
+            record.max_gap = max(gaps, default=0.0)
+            record.mean_gap = sum(gaps) / len(gaps) if gaps else 0.0
+            record.prompt_tokens = usage.prompt_tokens
+            record.completion_tokens = usage.completion_tokens
+            record.cache_read_tokens = usage.cache_read_tokens
+            _telemetry.record(record)
+
+
+async def cached_stream(
+    model: str,
+    messages: List[dict],
+    params: Dict[str, Any],
+    record: RequestRecord,
+    usage: Usage,
+) -> AsyncIterator[str]:
+    key = None
+    if _cache is not None:
+        key = _cache.key(model, messages, params)
+        cached = _cache.get(key)
+        if cached is not None:
+            record.cached = True
+            for chunk in cached:
+                yield chunk
+            return
+
+    if _router is None:
+        resp = provider_stream(model, messages, params, usage)
+        first = await first_chunk(resp)
+    else:
+        record.served, resp, first = await route(
+            _router, model, messages, params, usage
+        )
+
+    chunks = []
+    if first is not None:
+        chunks.append(first)
+        yield first
+        async for content in resp:
+            chunks.append(content)
+            yield content
+
+    if _cache is not None and key is not None:
+        _cache.put(key, model, chunks)
+
+
+async def warm(model: str, connections: int = 1) -> None:
+    """
+    Open connections to the provider of `model`, or to the providers of
+    a group, before the first request.
+    """
+
+    models = [model]
+    if _router is not None and model in _router.groups:
+        models = _router.groups[model]
+    await pool.warm(models, connections)
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    if _loop is None:
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+def run(coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine from synchronous code, on the loop used by `stream`.
+    """
+
+    return event_loop().run_until_complete(coro)
+
+
+def stream(
+    model: str, messages: List[dict], tag: str = "", **params: Any
+) -> Iterator[str]:
+    """
+    Synchronous version of `astream`.
+    """
+
+    loop = event_loop()
+    agen = astream(model, messages, tag, **params)
+    try:
+        while True:
+            step = asyncio.ensure_future(agen.__anext__(), loop=loop)
+            try:
+                yield loop.run_until_complete(step)
+            except StopAsyncIteration:
+                return
+            except KeyboardInterrupt:
+                # Ctrl-C leaves the step running and aclose() would refuse
+                step.cancel()
+                loop.run_until_complete(asyncio.gather(step, return_exceptions=True))
+                raise
+    finally:
+        loop.run_until_complete(agen.aclose())
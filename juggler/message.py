@@ -1,6 +1,8 @@
 import enum
-from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+# Anthropic accepts at most four cache breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
 
 
 class MessageType(str, enum.Enum):
@@ -9,41 +11,146 @@ class MessageType(str, enum.Enum):
     AI = "🤖"
 
     def to_role(self) -> Optional[str]:
-        conv = {
-            MessageType.SYSTEM: "system",
-            MessageType.USER: "user",
-            MessageType.AI: "assistant",
-        }
-        return conv.get(self)
+        return ROLES.get(self)
 
     @staticmethod
     def from_role(role: str) -> "MessageType":
-        if role == "system":
-            return MessageType.SYSTEM
-        elif role == "user":
-            return MessageType.USER
-        elif role == "assistant":
-            return MessageType.AI
-        else:
-            raise ValueError("Invalid message type", role)
+        try:
+            return TYPES[role]
+        except KeyError:
+            raise ValueError("Invalid message type", role) from None
+
+
+ROLES: Dict[MessageType, str] = {
+    MessageType.SYSTEM: "system",
+    MessageType.USER: "user",
+    MessageType.AI: "assistant",
+}
+TYPES: Dict[str, MessageType] = {role: t for t, role in ROLES.items()}
+
+
+class Message:
+    """
+    A chat message. Messages are not changed once created, so the
+    provider format is built on first use and reused for every request.
+    """
+
+    __slots__ = ("msg_type", "content", "cacheable", "_wire")
+
+    def __init__(self, msg_type: MessageType, content: str, cacheable: bool = False):
+        self.msg_type = msg_type
+        self.content = content
+        # stable prefix that the provider may cache between requests
+        self.cacheable = cacheable
+        self._wire: Optional[dict] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"Message(msg_type={self.msg_type!r}, content={self.content!r},"
+            f" cacheable={self.cacheable!r})"
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Message):
+            return NotImplemented
+        return (self.msg_type, self.content, self.cacheable) == (
+            other.msg_type,
+            other.content,
+            other.cacheable,
+        )
+
+    def to_dict(self, cache_control: bool = False) -> dict:
+        if cache_control and self.cacheable:
+            content = [
+                {
+                    "type": "text",
+                    "text": self.content,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+            return {"role": ROLES[self.msg_type], "content": content}
+        if self._wire is None:
+            self._wire = {"role": ROLES[self.msg_type], "content": self.content}
+        return self._wire
+
+
+class Chat:
+    """
+    Messages of a conversation with their provider format, kept up to
+    date as messages are added so that building a request does not
+    convert the whole history again. Messages must be appended with
+    `add_message`, or replaced by assigning `messages`.
+    """
+
+    __slots__ = (
+        "title",
+        "session_id",
+        "created_at",
+        "summary",
+        "summarized",
+        "_messages",
+        "_wire",
+        "_cacheable",
+    )
+
+    def __init__(
+        self,
+        title: str = "",
+        messages: Optional[List[Message]] = None,
+        session_id: str = "",
+        created_at: str = "",
+        summary: str = "",
+        summarized: int = 0,
+    ):
+        self.title = title
+        self.session_id = session_id
+        self.created_at = created_at
+        # rolling summary of the first `summarized` messages, see Compactor
+        self.summary = summary
+        self.summarized = summarized
+        self.messages = messages or []
 
+    def __repr__(self) -> str:
+        return (
+            f"Chat(title={self.title!r}, session_id={self.session_id!r},"
+            f" messages={len(self._messages)})"
+        )
 
-class Message(BaseModel):
-    msg_type: MessageType
-    content: str
+    @property
+    def messages(self) -> List[Message]:
+        return self._messages
 
-    def to_dict(self):
-        return {"role": self.msg_type.to_role(), "content": self.content}
+    @messages.setter
+    def messages(self, messages: List[Message]) -> None:
+        self._messages: List[Message] = []
+        self._wire: List[dict] = []
+        # indices of the cacheable messages
+        self._cacheable: List[int] = []
+        for msg in messages:
+            self.add_message(msg)
 
+    def to_dict(self, cache_control: bool = False) -> List[dict]:
+        """
+        Messages in the provider format. With `cache_control` the last
+        cacheable messages are marked as cache breakpoints.
 
-class Chat(BaseModel):
-    title: str = ""
-    messages: List[Message] = []
-    session_id: str = ""
-    created_at: str = ""
+        Without markers this is the list kept by the chat itself, not a
+        copy: callers must not add, remove or change its items, and it
+        grows as messages are added to the chat. Code handing it to a
+        library that may change it must pass a copy, like
+        `provider_stream` does.
+        """
 
-    def to_dict(self) -> List[dict[str, str]]:
-        return [m.to_dict() for m in self.messages]
+        breakpoints = self._cacheable[-MAX_CACHE_BREAKPOINTS:] if cache_control else []
+        if not breakpoints:
+            return self._wire
+        wire = self._wire.copy()
+        for i in breakpoints:
+            wire[i] = self._messages[i].to_dict(True)
+        return wire
 
     def add_message(self, msg: Message) -> None:
-        self.messages.append(msg)
+        if msg.cacheable:
+            self._cacheable.append(len(self._messages))
+        self._messages.append(msg)
+        self._wire.append(msg.to_dict())
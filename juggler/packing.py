@@ -0,0 +1,123 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+from juggler.config import cache_dir
+from juggler.context import ContextReport, SkippedFile
+from juggler.model import ContextFile
+
+# tokens kept free for the prompt around the context and the answer
+RESERVED_TOKENS = 8192
+# used when the model context window is unknown
+DEFAULT_BUDGET = 32000
+# a file is only truncated if at least this many tokens fit
+MIN_TRUNCATED_TOKENS = 256
+
+
+class TokenCache:
+    """
+    Token counts per model, keyed by content hash and persisted as
+    JSON, so unchanged files are not tokenized again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.dirty = False
+        if path.exists():
+            try:
+                self.counts = json.loads(path.read_text())
+            except ValueError:
+                logging.warning("ignoring corrupted token cache %s", path)
+
+    def count(self, model: str, text: str) -> int:
+        from litellm import token_counter
+
+        key = hashlib.sha256(text.encode("utf8")).hexdigest()
+        counts = self.counts.setdefault(model, {})
+        if key not in counts:
+            counts[key] = token_counter(model=model, text=text)
+            self.dirty = True
+        return counts[key]
+
+    def save(self) -> None:
+        if self.dirty:
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.counts))
+            tmp.replace(self.path)
+            self.dirty = False
+
+
+def context_budget(model: str) -> int:
+    """
+    Tokens available for context files with the given model.
+    """
+
+    from litellm import get_model_info
+
+    try:
+        window = get_model_info(model).get("max_input_tokens")
+    except Exception:
+        window = None
+    if not window:
+        return DEFAULT_BUDGET
+    return max(window - RESERVED_TOKENS, 0)
+
+
+def truncate(f: ContextFile, tokens: int, budget: int) -> ContextFile:
+    """
+    Cut file at a line boundary so that about `budget` of its `tokens`
+    are kept.
+    """
+
+    end = len(f.content) * budget // tokens
+    newline = f.content.rfind("\n", 0, end)
+    if newline > 0:
+        end = newline
+    return ContextFile(
+        filename=f.filename, content=f.content[:end] + "\n... [truncated]\n"
+    )
+
+
+def pack_context(
+    report: ContextReport, model: str, budget: Optional[int] = None
+) -> ContextReport:
+    """
+    Fit context files in a token budget. Smaller files are kept first so
+    that as many files as possible fit, the first file that does not fit
+    is truncated and the remaining ones are dropped. Kept files stay in
+    their original order.
+    """
+
+    if budget is None:
+        budget = context_budget(model)
+
+    cache = TokenCache(cache_dir().joinpath("tokens.json"))
+    tokens = [cache.count(model, f.content) for f in report.files]
+    cache.save()
+
+    order = sorted(range(len(report.files)), key=lambda i: tokens[i])
+    kept: Dict[int, ContextFile] = {}
+    skipped: List[SkippedFile] = []
+    used = 0
+    for i in order:
+        f = report.files[i]
+        remaining = budget - used
+        if tokens[i] <= remaining:
+            kept[i] = f
+            used += tokens[i]
+        elif remaining >= MIN_TRUNCATED_TOKENS:
+            kept[i] = truncate(f, tokens[i], remaining)
+            used += remaining
+            skipped.append(SkippedFile(filename=f.filename, reason="truncated"))
+        else:
+            skipped.append(SkippedFile(filename=f.filename, reason="token budget"))
+
+    files = [kept[i] for i in sorted(kept)]
+    return ContextReport(
+        files=files,
+        skipped=report.skipped + skipped,
+        total_bytes=sum(len(f.content.encode("utf8")) for f in files),
+        total_tokens=used,
+    )
@@ -0,0 +1,153 @@
+"""
+HTTP client shared by the requests to every provider. httpx keeps one
+pool of keep-alive connections per origin, so concurrent requests to a
+provider reuse warm connections instead of each paying DNS, TCP and TLS
+setup. `warm` opens them ahead of the first request.
+
+Connections belong to the event loop that opened them, so a client must
+be warmed and used from the same loop.
+"""
+
+import asyncio
+import contextvars
+import functools
+import importlib
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# seconds an idle connection is kept, the httpx default of 5 would drop
+# warmed connections while the user is still typing
+KEEPALIVE_EXPIRY = 300
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 600.0
+
+# providers that get_llm_provider returns no base URL for
+DEFAULT_BASES = {
+    "openai": "https://api.openai.com",
+    "anthropic": "https://api.anthropic.com",
+    "gemini": "https://generativelanguage.googleapis.com",
+}
+
+# providers whose streaming requests litellm sends through the handler
+# of another provider
+HANDLER_PROVIDERS = {"gemini": "vertex_ai"}
+
+_client: Any = None
+# litellm request handlers wrapping the shared client, by provider
+_handlers: Dict[str, Any] = {}
+# responses received while set, see `track`
+responses: contextvars.ContextVar[Optional[List[Any]]] = contextvars.ContextVar(
+    "responses", default=None
+)
+
+
+async def track(response: Any) -> None:
+    opened = responses.get()
+    if opened is not None:
+        opened.append(response)
+
+
+def client() -> Any:
+    global _client
+    if _client is None:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={"response": [track]},
+        )
+    return _client
+
+
+async def close(opened: List[Any]) -> None:
+    """
+    Close responses collected in `responses`. A stream closed before
+    its end also closes its connection, which stops the generation.
+    """
+
+    for response in opened:
+        await response.aclose()
+
+
+@functools.lru_cache
+def provider(model: str) -> Tuple[str, Optional[str]]:
+    """
+    Provider of `model` and the base URL litellm sends its requests to.
+    """
+
+    import litellm
+
+    _, name, _, base = litellm.get_llm_provider(model)
+    base = (
+        base
+        or litellm.api_base
+        or os.environ.get(f"{name.upper()}_API_BASE")
+        or DEFAULT_BASES.get(name)
+    )
+    return name, base
+
+
+def install(model: str) -> None:
+    """
+    Make litellm send the requests of `model` through the shared client.
+    """
+
+    import litellm
+    from litellm.llms.custom_httpx.http_handler import (
+        _DEFAULT_TTL_FOR_HTTPX_CLIENTS,
+        AsyncHTTPHandler,
+    )
+
+    # OpenAI compatible providers go through SDK clients built on it
+    litellm.aclient_session = client()
+
+    # the other providers use a handler cached per provider, which can
+    # expire from the litellm cache and must then be put back. The key is
+    # the one get_async_httpx_client builds for streaming requests, which
+    # pass it no client params.
+    name = provider(model)[0]
+    key = "async_httpx_client" + HANDLER_PROVIDERS.get(name, name)
+    handler = _handlers.get(name)
+    cached = litellm.in_memory_llm_clients_cache.get_cache(key)
+    if handler is not None and cached is handler:
+        return
+    if handler is None:
+        handler = AsyncHTTPHandler(timeout=READ_TIMEOUT)
+        handler.client = client()
+        _handlers[name] = handler
+    litellm.in_memory_llm_clients_cache.set_cache(
+        key=key, value=handler, ttl=_DEFAULT_TTL_FOR_HTTPX_CLIENTS
+    )
+
+
+async def _connect(url: str) -> None:
+    try:
+        # any response leaves a connection to the origin in the pool
+        await client().head(url)
+    except Exception:
+        pass
+
+
+async def warm(models: List[str], connections: int = 1) -> None:
+    """
+    Open `connections` connections to the provider of each model.
+    Errors are ignored, the requests will report them.
+    """
+
+    # litellm takes about a second to import, keep the loop responsive
+    await asyncio.to_thread(importlib.import_module, "litellm")
+    urls = set()
+    for model in models:
+        try:
+            install(model)
+            base = provider(model)[1]
+        except Exception:
+            continue
+        if base is not None:
+            urls.add(base)
+    await asyncio.gather(*[_connect(url) for url in urls for _ in range(connections)])
@@ -0,0 +1,244 @@
+"""
+Retrieval of the context chunks relevant to a question, so that the
+prompt grows with the question instead of with the context directory.
+
+Files are cut in chunks of lines embedded on the CPU: identifiers are
+split in words, hashed into a fixed number of dimensions and weighted
+by inverse document frequency at query time. The vectors are kept in a
+persistent index and only files whose content changed are embedded
+again.
+"""
+
+import hashlib
+import os
+import re
+import sys
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import orjson
+from juggler.model import ContextFile
+
+# dimensions of the hashed embeddings
+DIM = 1024
+# lines and characters per chunk, longer lines are cut
+CHUNK_LINES = 60
+CHUNK_CHARS = 4000
+# lines repeated at the start of the next chunk
+OVERLAP_LINES = 10
+# bump when chunking or embedding changes to rebuild existing indexes
+VERSION = 1
+
+WORD = re.compile(r"[A-Za-z0-9_]+")
+# parts of camelCase, snake_case and numbers
+PART = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def chunk_spans(text: str) -> List[Tuple[int, int, int]]:
+    """
+    Character start, end and first line number of each chunk of text.
+    """
+
+    lines = text.splitlines(keepends=True)
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+
+    spans = []
+    i = 0
+    while i < len(lines):
+        j = i + 1
+        while (
+            j < len(lines)
+            and j - i < CHUNK_LINES
+            and offsets[j + 1] - offsets[i] <= CHUNK_CHARS
+        ):
+            j += 1
+        start = offsets[i]
+        spans.append((start, min(offsets[j], start + CHUNK_CHARS), i + 1))
+        if j == len(lines):
+            break
+        i = max(j - OVERLAP_LINES, i + 1)
+    return spans
+
+
+def features(text: str) -> Counter:
+    """
+    Lowercase words of text, with identifiers also split in parts.
+    """
+
+    counts: Counter = Counter()
+    for word in WORD.findall(text):
+        counts[word.lower()] += 1
+        parts = PART.findall(word)
+        if len(parts) > 1:
+            counts.update(p.lower() for p in parts)
+    return counts
+
+
+def digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+def embed(texts: List[str]) -> Any:
+    """
+    Hashed term frequency vectors, one row per text.
+    """
+
+    import numpy as np
+
+    vectors = np.zeros((len(texts), DIM), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in features(text).items():
+            # sublinear term frequency, stable across processes
+            column = zlib.crc32(feature.encode("utf8")) % DIM
+            vectors[row, column] += 1 + np.log(count)
+    return vectors
+
+
+class ChunkIndex:
+    """
+    Embedded chunks of a set of files persisted in a NumPy archive. A
+    file is embedded again only if its modification time or size and
+    its content hash changed since it was indexed.
+    """
+
+    def __init__(self, path: Path):
+        import numpy as np
+
+        self.path = path
+        # absolute path -> mtime, size, sha256 and chunk spans
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.vectors = np.zeros((0, DIM), dtype=np.float32)
+        # file and span of each row of vectors
+        self.rows: List[Tuple[ContextFile, List[int]]] = []
+        if path.exists():
+            try:
+                with np.load(path) as data:
+                    meta = orjson.loads(data["meta"].tobytes())
+                    if meta.get("version") == VERSION:
+                        self.files = meta["files"]
+                        self.vectors = data["vectors"]
+            except (OSError, ValueError, KeyError):
+                print(f"retrieval: rebuilding unreadable {path}", file=sys.stderr)
+
+    def update(self, files: List[ContextFile]) -> int:
+        """
+        Index exactly `files`, embedding the changed ones, and return
+        the number of files embedded.
+        """
+
+        import numpy as np
+
+        offsets: Dict[str, int] = {}
+        row = 0
+        for name, entry in self.files.items():
+            offsets[name] = row
+            row += len(entry["spans"])
+
+        indexed: Dict[str, Dict[str, Any]] = {}
+        blocks = []
+        self.rows = []
+        changed = 0
+        dirty = False
+        for f in files:
+            name = os.path.abspath(f.filename)
+            stat = os.stat(name)
+            entry = self.files.get(name)
+            if entry is not None and (
+                entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size
+            ):
+                # touched files keep their vectors if the content is the same
+                if entry["sha"] == digest(f.content):
+                    entry = {**entry, "mtime": stat.st_mtime, "size": stat.st_size}
+                else:
+                    entry = None
+                dirty = True
+
+            if entry is None:
+                spans = chunk_spans(f.content)
+                entry = {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "sha": digest(f.content),
+                    "spans": spans,
+                }
+                blocks.append(embed([f.content[s:e] for s, e, _ in spans]))
+                changed += 1
+            else:
+                start = offsets[name]
+                blocks.append(self.vectors[start : start + len(entry["spans"])])
+
+            indexed[name] = entry
+            self.rows.extend((f, span) for span in entry["spans"])
+
+        dirty = dirty or changed > 0 or list(indexed) != list(self.files)
+        self.files = indexed
+        if blocks:
+            self.vectors = np.concatenate(blocks)
+        else:
+            self.vectors = np.zeros((0, DIM), dtype=np.float32)
+        if dirty:
+            self.save()
+        return changed
+
+    def save(self) -> None:
+        import numpy as np
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        meta = orjson.dumps({"version": VERSION, "files": self.files})
+        tmp = self.path.with_suffix(".tmp.npz")
+        np.savez(tmp, vectors=self.vectors, meta=np.frombuffer(meta, dtype=np.uint8))
+        tmp.replace(self.path)
+
+    def search(self, query: str, k: int) -> List[ContextFile]:
+        """
+        The `k` chunks most similar to `query`, best first, named after
+        their file and first line.
+        """
+
+        import numpy as np
+
+        if not self.rows or k <= 0:
+            return []
+
+        # inverse document frequency of each dimension over the chunks
+        df = np.count_nonzero(self.vectors, axis=0)
+        idf = np.log((len(self.rows) + 1) / (df + 1)) + 1
+        matrix = self.vectors * idf
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9)
+        q = embed([query])[0] * idf
+        q /= max(float(np.linalg.norm(q)), 1e-9)
+
+        scores = matrix @ q
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        chunks = []
+        for i in top:
+            f, (start, end, line) = self.rows[i]
+            name = f"{f.filename}:{line}"
+            chunks.append(ContextFile(filename=name, content=f.content[start:end]))
+        return chunks
+
+
+class Retriever:
+    """
+    Context of a template resolved per run: the chunks of the index most
+    relevant to the value of the `query` variable.
+    """
+
+    def __init__(self, index: ChunkIndex, k: int, query: str = "question"):
+        self.index = index
+        self.k = k
+        self.query = query
+
+    def retrieve(self, text: str) -> List[ContextFile]:
+        return self.index.search(text, self.k)
+
+
+def index_path(cache: Path, pattern: str) -> Path:
+    key = hashlib.sha256(os.path.abspath(pattern).encode("utf8")).hexdigest()
+    return cache.joinpath("index", f"{key[:16]}.npz")
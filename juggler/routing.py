@@ -0,0 +1,85 @@
+import json
+import logging
+import statistics
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional
+
+# samples kept per model
+WINDOW = 20
+# seconds added to the expected latency for a model that always fails
+ERROR_PENALTY = 30.0
+
+
+class ModelStats:
+    """
+    Rolling time to first token and outcome of the last requests sent
+    to a model.
+    """
+
+    def __init__(self, ttft: List[float], errors: List[int]):
+        self.ttft: Deque[float] = deque(ttft, maxlen=WINDOW)
+        self.errors: Deque[int] = deque(errors, maxlen=WINDOW)
+
+    def score(self) -> float:
+        """
+        Expected seconds to the first token, unknown models score 0 so
+        they are tried first.
+        """
+
+        if not self.errors:
+            return 0.0
+        ttft = statistics.median(self.ttft) if self.ttft else 0.0
+        return ttft + ERROR_PENALTY * sum(self.errors) / len(self.errors)
+
+
+class Router:
+    """
+    Resolve a model name to the models that can serve it. A group of
+    equivalent models is ordered by their rolling latency and error
+    rate, persisted as JSON so that short lived commands share it.
+    With `hedge_after` a request that got no token within that many
+    seconds is also sent to the next model of the group.
+    """
+
+    def __init__(
+        self, groups: Dict[str, List[str]], hedge_after: Optional[float], path: Path
+    ):
+        self.groups = groups
+        self.hedge_after = hedge_after
+        self.path = path
+        self.stats: Dict[str, ModelStats] = {}
+        if path.exists():
+            try:
+                for model, raw in json.loads(path.read_text()).items():
+                    self.stats[model] = ModelStats(raw["ttft"], raw["errors"])
+            except (ValueError, KeyError, TypeError):
+                logging.warning("ignoring corrupted routing stats %s", path)
+
+    def _stats(self, model: str) -> ModelStats:
+        return self.stats.setdefault(model, ModelStats([], []))
+
+    def candidates(self, model: str) -> List[str]:
+        if model not in self.groups:
+            return [model]
+        # sorted is stable, ties keep the configured order
+        return sorted(self.groups[model], key=lambda m: self._stats(m).score())
+
+    def record(self, model: str, ttft: float) -> None:
+        stats = self._stats(model)
+        stats.ttft.append(ttft)
+        stats.errors.append(0)
+        self.save()
+
+    def record_error(self, model: str) -> None:
+        self._stats(model).errors.append(1)
+        self.save()
+
+    def save(self) -> None:
+        data = {
+            model: {"ttft": list(s.ttft), "errors": list(s.errors)}
+            for model, s in self.stats.items()
+        }
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data))
+        tmp.replace(self.path)
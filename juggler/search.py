@@ -0,0 +1,30 @@
+import re
+from rich.console import Console
+from rich.text import Text
+from typing import List
+from juggler.store import HIT_END, HIT_START, SearchHit
+
+
+def highlight(snippet: str, style: str = "bold reverse") -> Text:
+    """
+    Snippet on a single line with the matched terms styled.
+    """
+
+    text = Text()
+    for i, part in enumerate(re.split(f"[{HIT_START}{HIT_END}]", snippet)):
+        text.append(part.replace("\n", " "), style if i % 2 else "")
+    return text
+
+
+def print_hits(hits: List[SearchHit]) -> None:
+    console = Console(highlight=False)
+    for hit in hits:
+        console.print(
+            Text.assemble(
+                (hit.title.strip() or "New chat", "bold"),
+                (f"  {hit.created_at[:16]}  {hit.session_id}", "dim"),
+            )
+        )
+        console.print(
+            Text.assemble(f"  {hit.msg_type.to_role()}: ", highlight(hit.snippet))
+        )
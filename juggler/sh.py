@@ -1,23 +1,88 @@
+import asyncio
 import sys
 import pathlib
 import re
-import subprocess
+import threading
+import time
 from jinja2 import Environment, FileSystemLoader, select_autoescape
-from litellm import completion
+from juggler.command import ShellSession
+from juggler.compaction import Compactor
+from juggler.llm import cache_control, event_loop, run, stream, warm
 from juggler.message import Chat, MessageType, Message
-from rich.console import Console
+from juggler.stream import BlockSplitter
+from rich.console import Console, ConsoleOptions, RenderResult
 from rich.prompt import Prompt, Confirm
 from rich.markdown import Markdown
 from rich.live import Live
+from rich.segment import Segment
+from typing import Dict, List, Optional, Tuple
 
 
 class AgentPrompt(Prompt):
     prompt_suffix = ""
 
 
+class StreamingMarkdown:
+    """
+    Renderable for a streamed markdown reply. Completed blocks are
+    rendered once per width and cached, only the trailing open block is
+    parsed again when the view is refreshed.
+    """
+
+    def __init__(self):
+        self.splitter = BlockSplitter()
+        self._blocks: List[str] = []
+        self._tail = Markdown("")
+        self._rendered: Dict[Tuple[int, int], List[List[Segment]]] = {}
+
+    @property
+    def text(self) -> str:
+        return self.splitter.text
+
+    def feed(self, delta: str) -> None:
+        self.splitter.feed(delta)
+
+    def _update(self) -> None:
+        blocks = self.splitter.pop_blocks()
+        if blocks:
+            self._blocks.append(blocks)
+        self._tail = Markdown(self.splitter.tail)
+
+    def __rich_console__(
+        self, console: Console, options: ConsoleOptions
+    ) -> RenderResult:
+        self._update()
+        new_line = Segment.line()
+        for i, block in enumerate(self._blocks):
+            key = (i, options.max_width)
+            if key not in self._rendered:
+                self._rendered[key] = console.render_lines(
+                    Markdown(block), options, pad=False
+                )
+            for line in self._rendered[key]:
+                yield from line
+                yield new_line
+        yield self._tail
+
+
 class SHAgent:
-    def __init__(self, model: str):
+    def __init__(
+        self,
+        model: str,
+        refresh_per_second: float = 4,
+        compactor: Optional[Compactor] = None,
+        timeout: float = 60,
+        max_output_bytes: int = 16 * 1024,
+    ):
         self._model = model
+        self._refresh_per_second = refresh_per_second
+        self._compactor = compactor
+        self._compacting: Optional[asyncio.Task] = None
+        # connections opened while the first prompt is typed
+        self._warming: Optional[asyncio.Task] = None
+        self._timeout = timeout
+        self._max_output_bytes = max_output_bytes
+        self._session = ShellSession()
         self._sh_regex = re.compile(r"```sh([\s\S]+)```")
         self._chat = Chat()
         self._prompt = AgentPrompt()
@@ -33,25 +98,61 @@ class SHAgent:
         Append system message
         """
 
-        out, err = self._cmd("uname -a && $SHELL --version")
+        result = self._session.run(
+            "uname -a && $SHELL --version",
+            self._timeout,
+            self._max_output_bytes,
+            echo=False,
+        )
         t = self._env.get_template("sh_system.j2")
         self._chat.add_message(
             Message(
                 msg_type=MessageType.SYSTEM,
-                content=t.render(shell=out.decode("utf8")),
+                content=t.render(shell=result.output),
+                cacheable=True,
             )
         )
 
-    def _cmd(self, cmd: str):
-        p = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
-        return p.communicate()
+    def _messages(self) -> List[dict]:
+        if self._compactor is None:
+            return self._chat.to_dict(cache_control(self._model))
+        return self._compactor.messages(self._chat, cache_control(self._model))
+
+    def close(self):
+        self._session.close()
+
+    def _ask(self) -> str:
+        """
+        Read the next prompt while the event loop runs, so that work
+        scheduled on it goes on as the user types.
+        """
+
+        loop = event_loop()
+        answer = loop.create_future()
+
+        def read() -> None:
+            try:
+                result = self._prompt.ask("[bold green]>[/bold green] ")
+            except BaseException as e:
+                loop.call_soon_threadsafe(answer.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(answer.set_result, result)
+
+        threading.Thread(target=read, daemon=True).start()
+        return run(answer)
 
     def run(self):
         console = Console()
+        # runs while the first prompt is typed, the loop only keeps a
+        # weak reference to the task
+        self._warming = event_loop().create_task(warm(self._model))
         while True:
-            inp = self._prompt.ask("[bold green]>[/bold green] ")
+            try:
+                inp = self._ask()
+            except EOFError:
+                # Ctrl-D, or the end of piped input
+                sys.stdout.write("\n")
+                return
             self._chat.add_message(
                 Message(
                     msg_type=MessageType.USER,
@@ -59,19 +160,18 @@ class SHAgent:
                 )
             )
 
-            resp = completion(
-                model=self._model, messages=self._chat.to_dict(), stream=True
-            )
-
-            assistant = ""
-            with Live(Markdown(""), refresh_per_second=1) as live:
-                # sys.stdout.write("\n")
-                for part in resp:
-                    content = part.choices[0].delta.content  # pyright: ignore
-                    if content is not None:
-                        assistant += content
-                        live.update(Markdown(assistant))
+            view = StreamingMarkdown()
+            interval = 1 / self._refresh_per_second
+            with Live(view, auto_refresh=False) as live:
+                refreshed = time.monotonic()
+                for content in stream(self._model, self._messages(), "shell"):
+                    view.feed(content)
+                    if time.monotonic() - refreshed >= interval:
+                        live.refresh()
+                        refreshed = time.monotonic()
+                live.refresh()
             sys.stdout.write("\n")
+            assistant = view.text
             self._chat.add_message(
                 Message(
                     msg_type=MessageType.AI,
@@ -81,18 +181,29 @@ class SHAgent:
 
             m = self._sh_regex.match(assistant.strip())
             if m:
-                run = Confirm.ask("run?", default=True)
-                if run:
+                confirmed = Confirm.ask("run?", default=True)
+                if confirmed:
                     cmd = m.group(1)
-                    out, err = self._cmd(cmd)
-
-                    console.print(Markdown(f"```sh\n{out.decode()}\n```"))
-                    if err:
-                        console.print(Markdown(f"```sh\n{err.decode()}\n```"))
+                    # output is echoed while the command runs
+                    result = self._session.run(
+                        cmd, self._timeout, self._max_output_bytes
+                    )
+                    console.print(f"[dim]{result.status(self._timeout)}[/dim]")
 
                     self._chat.add_message(
                         Message(
                             msg_type=MessageType.SYSTEM,
-                            content=out.decode().strip(),
+                            content=result.summary(self._timeout),
                         )
                     )
+
+            # summarize turns leaving the window while the next prompt is
+            # typed, the summary is sent once it is written
+            if (
+                self._compactor is not None
+                and (self._compacting is None or self._compacting.done())
+                and self._compactor.pending(self._chat)
+            ):
+                self._compacting = event_loop().create_task(
+                    self._compactor.compact(self._chat, self._model)
+                )
@@ -0,0 +1,192 @@
+import sqlite3
+from pathlib import Path
+from typing import List, NamedTuple
+from juggler.message import Chat, Message, MessageType
+
+# delimiters of the matched terms in search snippets
+HIT_START = "\x02"
+HIT_END = "\x03"
+
+
+class SearchHit(NamedTuple):
+    session_id: str
+    title: str
+    created_at: str
+    position: int
+    msg_type: MessageType
+    snippet: str
+
+
+def fts_query(text: str) -> str:
+    """
+    FTS5 query matching messages with every word of `text`, the last
+    one as a prefix so that results follow typing.
+    """
+
+    terms = [
+        '"' + word.replace('"', '""') + '"'
+        for word in text.split()
+        if any(c.isalnum() for c in word)
+    ]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+class SessionStore:
+    """
+    Durable chat sessions backed by SQLite. Session metadata and
+    messages are kept in separate tables so that sessions can be listed
+    without reading their bodies, and messages are appended one row at a
+    time instead of rewriting the whole chat. A full-text index over
+    the messages is updated by triggers as they are appended.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                title TEXT NOT NULL DEFAULT '',
+                created_at TEXT NOT NULL DEFAULT '',
+                summary TEXT NOT NULL DEFAULT '',
+                summarized INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL REFERENCES sessions(session_id),
+                position INTEGER NOT NULL,
+                msg_type TEXT NOT NULL,
+                content TEXT NOT NULL,
+                UNIQUE (session_id, position)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                content='messages',
+                content_rowid='id',
+                tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+            BEGIN
+                INSERT INTO messages_fts (messages_fts, rowid, content)
+                VALUES ('delete', old.id, old.content);
+            END;
+            """
+        )
+
+    def list_sessions(self) -> List[Chat]:
+        """
+        Return every session with metadata only, oldest first. Messages
+        must be loaded with `load_messages`.
+        """
+
+        rows = self.conn.execute(
+            """
+            SELECT session_id, title, created_at, summary, summarized
+            FROM sessions ORDER BY created_at
+            """
+        )
+        return [
+            Chat(
+                session_id=session_id,
+                title=title,
+                created_at=created_at,
+                summary=summary,
+                summarized=summarized,
+            )
+            for session_id, title, created_at, summary, summarized in rows
+        ]
+
+    def load_messages(self, session_id: str) -> List[Message]:
+        rows = self.conn.execute(
+            "SELECT msg_type, content FROM messages WHERE session_id = ? ORDER BY position",
+            (session_id,),
+        )
+        return [
+            Message(msg_type=MessageType(msg_type), content=content)
+            for msg_type, content in rows
+        ]
+
+    def save_session(self, chat: Chat) -> None:
+        """
+        Insert or update session metadata.
+        """
+
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO sessions (session_id, title, created_at) VALUES (?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET title = excluded.title
+                """,
+                (chat.session_id, chat.title, chat.created_at),
+            )
+
+    def save_summary(self, chat: Chat) -> None:
+        """
+        Persist the rolling summary of a session, see Compactor.
+        """
+
+        with self.conn:
+            self.conn.execute(
+                "UPDATE sessions SET summary = ?, summarized = ? WHERE session_id = ?",
+                (chat.summary, chat.summarized, chat.session_id),
+            )
+
+    def append_message(self, chat: Chat, msg: Message) -> None:
+        """
+        Persist a message already added to `chat`. The session row is
+        created on first use.
+        """
+
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, title, created_at) VALUES (?, ?, ?)",
+                (chat.session_id, chat.title, chat.created_at),
+            )
+            self.conn.execute(
+                "INSERT INTO messages (session_id, position, msg_type, content) VALUES (?, ?, ?, ?)",
+                (
+                    chat.session_id,
+                    len(chat.messages) - 1,
+                    msg.msg_type.value,
+                    msg.content,
+                ),
+            )
+
+    def search(self, text: str, limit: int = 20) -> List[SearchHit]:
+        """
+        Messages matching the words of `text`, best first. Matched terms
+        are delimited by HIT_START and HIT_END in the snippets.
+        """
+
+        query = fts_query(text)
+        if not query:
+            return []
+        rows = self.conn.execute(
+            """
+            SELECT m.session_id, s.title, s.created_at, m.position, m.msg_type,
+                snippet(messages_fts, 0, ?, ?, '…', 12)
+            FROM messages_fts
+            JOIN messages m ON m.id = messages_fts.rowid
+            JOIN sessions s ON s.session_id = m.session_id
+            WHERE messages_fts MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """,
+            (HIT_START, HIT_END, query, limit),
+        )
+        return [
+            SearchHit(session_id, title, created_at, position, MessageType(t), snippet)
+            for session_id, title, created_at, position, t, snippet in rows
+        ]
+
+    def close(self) -> None:
+        self.conn.close()
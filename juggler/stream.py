@@ -0,0 +1,88 @@
+from typing import List, Optional
+
+
+class StreamBuffer:
+    """
+    Accumulate streamed text deltas. Chunks are joined only when the
+    text is read, avoiding quadratic string concatenation.
+    """
+
+    def __init__(self, text: str = ""):
+        self._chunks: List[str] = [text] if text else []
+        self._size = len(text)
+
+    def append(self, delta: str) -> None:
+        self._chunks.append(delta)
+        self._size += len(delta)
+
+    @property
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class BlockSplitter:
+    """
+    Split streamed markdown into completed blocks and the trailing block
+    that is still being written. A block is completed by a blank line
+    outside of a fenced code block, so completed blocks never change and
+    only the tail needs to be re-rendered.
+    """
+
+    def __init__(self, text: str = ""):
+        self.buffer = StreamBuffer()
+        # end of completed blocks already returned by `pop_blocks`
+        self._popped = 0
+        # end of completed blocks
+        self._stable = 0
+        # end of the last complete line scanned
+        self._scanned = 0
+        self._fence: Optional[str] = None
+        if text:
+            self.feed(text)
+
+    def feed(self, delta: str) -> None:
+        self.buffer.append(delta)
+
+    @property
+    def text(self) -> str:
+        return self.buffer.text
+
+    def _scan(self) -> None:
+        text = self.buffer.text
+        while True:
+            eol = text.find("\n", self._scanned)
+            if eol == -1:
+                return
+            line = text[self._scanned : eol].strip()
+            self._scanned = eol + 1
+
+            if self._fence is None:
+                if line.startswith("```") or line.startswith("~~~"):
+                    self._fence = line[:3]
+                elif line == "":
+                    self._stable = self._scanned
+            elif line.startswith(self._fence) and line.strip("`~ ") == "":
+                self._fence = None
+
+    def pop_blocks(self) -> str:
+        """
+        Return text of blocks completed since the last call.
+        """
+
+        self._scan()
+        blocks = self.buffer.text[self._popped : self._stable]
+        self._popped = self._stable
+        return blocks
+
+    @property
+    def tail(self) -> str:
+        """
+        Text after the last block returned by `pop_blocks`.
+        """
+
+        return self.buffer.text[self._popped :]
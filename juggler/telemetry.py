@@ -0,0 +1,178 @@
+import sqlite3
+import statistics
+import time
+from pathlib import Path
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+# records used to compute the Prometheus summaries
+PROMETHEUS_WINDOW = 1000
+
+
+class RequestRecord(BaseModel):
+    """
+    Measurements of one completion request. Times are in seconds,
+    `served` is the model that answered when `model` is a routing group
+    and `tag` names the entry point or template.
+    """
+
+    time: float
+    model: str
+    served: str = ""
+    tag: str = ""
+    status: str = "ok"
+    cached: bool = False
+    prompt_bytes: int = 0
+    response_bytes: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cache_read_tokens: int = 0
+    ttft: Optional[float] = None
+    latency: float = 0.0
+    max_gap: float = 0.0
+    mean_gap: float = 0.0
+
+    def tokens_per_second(self) -> Optional[float]:
+        if self.ttft is None or self.completion_tokens == 0:
+            return None
+        generation = self.latency - self.ttft
+        if generation <= 0:
+            return None
+        return self.completion_tokens / generation
+
+
+def percentile(values: List[float], p: int) -> Optional[float]:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+class Telemetry:
+    """
+    Request records stored in SQLite. With `prometheus` a textfile for
+    the node exporter is rewritten after each request.
+    """
+
+    def __init__(self, path: Path, prometheus: Optional[Path] = None):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.prometheus = prometheus
+        self.conn = sqlite3.connect(path)
+        columns = ", ".join(RequestRecord.model_fields)
+        self.conn.executescript(
+            f"""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS requests ({columns});
+            CREATE INDEX IF NOT EXISTS requests_time ON requests(time);
+            """
+        )
+
+    def record(self, record: RequestRecord) -> None:
+        values = record.model_dump()
+        placeholders = ", ".join("?" for _ in values)
+        with self.conn:
+            self.conn.execute(
+                f"INSERT INTO requests ({', '.join(values)}) VALUES ({placeholders})",
+                list(values.values()),
+            )
+        if self.prometheus is not None:
+            self.write_prometheus(self.prometheus)
+
+    def records(self, since: float = 0, limit: int = -1) -> List[RequestRecord]:
+        cursor = self.conn.execute(
+            "SELECT * FROM requests WHERE time >= ? ORDER BY time DESC LIMIT ?",
+            (since, limit),
+        )
+        names = [d[0] for d in cursor.description]
+        return [RequestRecord(**dict(zip(names, row))) for row in cursor]
+
+    def write_prometheus(self, path: Path) -> None:
+        by_model: Dict[str, List[RequestRecord]] = {}
+        for r in self.records(limit=PROMETHEUS_WINDOW):
+            by_model.setdefault(r.served or r.model, []).append(r)
+
+        lines = [
+            "# HELP juggler_requests Recent completion requests by status.",
+            "# TYPE juggler_requests gauge",
+        ]
+        for model, records in sorted(by_model.items()):
+            statuses: Dict[str, int] = {}
+            for r in records:
+                statuses[r.status] = statuses.get(r.status, 0) + 1
+            for status, count in sorted(statuses.items()):
+                lines.append(
+                    f'juggler_requests{{model="{model}",status="{status}"}} {count}'
+                )
+
+        for metric, description in [
+            ("ttft", "Time to first token"),
+            ("latency", "Total request latency"),
+        ]:
+            lines.append(f"# HELP juggler_{metric}_seconds {description}.")
+            lines.append(f"# TYPE juggler_{metric}_seconds summary")
+            for model, records in sorted(by_model.items()):
+                values: List[float] = [
+                    getattr(r, metric)
+                    for r in records
+                    if r.status == "ok" and not r.cached and getattr(r, metric)
+                ]
+                for q in (50, 95, 99):
+                    value = percentile(values, q)
+                    if value is not None:
+                        lines.append(
+                            f"juggler_{metric}_seconds"
+                            f'{{model="{model}",quantile="{q / 100}"}} {value:.4f}'
+                        )
+                lines.append(
+                    f'juggler_{metric}_seconds_sum{{model="{model}"}} {sum(values):.4f}'
+                )
+                lines.append(
+                    f'juggler_{metric}_seconds_count{{model="{model}"}} {len(values)}'
+                )
+
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text("\n".join(lines) + "\n")
+        tmp.replace(path)
+
+    def print_stats(self, by: str, days: float) -> None:
+        """
+        Print percentiles of requests of the last `days` grouped by
+        model or by template.
+        """
+
+        groups: Dict[str, List[RequestRecord]] = {}
+        for r in self.records(since=time.time() - days * 24 * 60 * 60):
+            key = (r.served or r.model) if by == "model" else (r.tag or "-")
+            groups.setdefault(key, []).append(r)
+
+        print(
+            f"{by:<32} {'reqs':>5} {'err':>4} {'cache':>5}"
+            f" {'ttft p50':>8} {'p95':>6} {'lat p50':>8} {'p95':>6}"
+            f" {'tok/s':>6} {'gap p95':>7}"
+        )
+        for key, records in sorted(groups.items()):
+            # cached responses are replayed and would hide provider latency
+            live = [r for r in records if r.status == "ok" and not r.cached]
+            ttft = [r.ttft for r in live if r.ttft is not None]
+            latency = [r.latency for r in live]
+            rates = [t for t in (r.tokens_per_second() for r in live) if t is not None]
+            errors = sum(1 for r in records if r.status == "error")
+            cached = sum(1 for r in records if r.cached)
+            rate = percentile(rates, 50)
+            print(
+                f"{key:<32} {len(records):>5} {errors:>4} {cached:>5}"
+                f" {format_seconds(percentile(ttft, 50)):>8}"
+                f" {format_seconds(percentile(ttft, 95)):>6}"
+                f" {format_seconds(percentile(latency, 50)):>8}"
+                f" {format_seconds(percentile(latency, 95)):>6}"
+                f" {'-' if rate is None else f'{rate:.0f}':>6}"
+                f" {format_seconds(percentile([r.max_gap for r in live], 95)):>7}"
+            )
+
+    def close(self) -> None:
+        self.conn.close()
@@ -1,113 +1,413 @@
+import asyncio
+import os
 import sys
-from jinja2 import Environment, select_autoescape, meta
-from litellm import completion
+from jinja2 import (
+    BaseLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    select_autoescape,
+    meta,
+)
+from jinja2 import Template as JinjaTemplate
+from jinja2 import nodes
+from juggler.llm import astream, cache_control
 from juggler.message import Chat, MessageType, Message
 from juggler.model import ContextFile
-from typing import Any, List, Optional
+from juggler.retrieval import Retriever
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
 from pathlib import Path
-import re
+from juggler.catalog import TemplateCatalog
 
+# context files, or a retriever choosing them once the question is known
+Context = Union[List[ContextFile], Retriever]
 
-class Template:
-    def __init__(self, model: str, prompt: str):
+# names provided to every segment when it is rendered
+BUILTINS = {
+    "system",
+    "user",
+    "assistant",
+    "context",
+    "inputs",
+    "branch",
+    "join",
+    "branches",
+    "cache",
+}
+
+
+class Segment(NamedTuple):
+    """
+    Compiled segment and the variables it expects from the caller.
+    `branch` is set when the segment starts a branch and `join` when it
+    waits for the branches before it.
+    """
+
+    template: JinjaTemplate
+    variables: Set[str]
+    branch: Optional[str] = None
+    join: bool = False
+
+
+def split_prompt(prompt: str) -> List[str]:
+    return prompt.split("---")
+
+
+def create_environment(
+    loader: Optional[BaseLoader] = None, bytecode_dir: Optional[Path] = None
+) -> Environment:
+    return Environment(
+        loader=loader,
+        autoescape=select_autoescape(),
+        enable_async=True,
+        bytecode_cache=FileSystemBytecodeCache(str(bytecode_dir))
+        if bytecode_dir is not None
+        else None,
+    )
+
+
+def undeclared(env: Environment, source: str) -> Set[str]:
+    return meta.find_undeclared_variables(env.parse(source)) - BUILTINS
+
+
+def compile_segment(env: Environment, source: str, template: JinjaTemplate) -> Segment:
+    ast = env.parse(source)
+    branch = None
+    join = False
+    for call in ast.find_all(nodes.Call):
+        if not isinstance(call.node, nodes.Name):
+            continue
+        if call.node.name == "branch":
+            if len(call.args) != 1 or not isinstance(call.args[0], nodes.Const):
+                raise ValueError("branch() expects a constant name", source)
+            branch = str(call.args[0].value)
+        elif call.node.name == "join":
+            join = True
+    variables = meta.find_undeclared_variables(ast) - BUILTINS
+    return Segment(template, variables, branch, join)
+
+
+def marker(*args: Any) -> str:
+    # branch() and join() are resolved when the template is compiled
+    return ""
+
+
+_string_env: Optional[Environment] = None
+_string_segments: Dict[str, List[Segment]] = {}
+
+
+def compile_prompt(prompt: str) -> List[Segment]:
+    """
+    Compile a prompt given as a string, reusing earlier compilations of
+    the same text.
+    """
+
+    global _string_env
+    if prompt not in _string_segments:
+        if _string_env is None:
+            _string_env = create_environment()
+        env = _string_env
+        _string_segments[prompt] = [
+            compile_segment(env, source, env.from_string(source))
+            for source in split_prompt(prompt)
+        ]
+    return _string_segments[prompt]
+
+
+class Conversation:
+    """
+    State of a single template run: the role being written and the chat
+    built so far.
+    """
+
+    def __init__(self, model: str, quiet: bool, name: str = ""):
         self.model = model
-        self.prompt = prompt
+        self.quiet = quiet
+        self.name = name
         self.role: MessageType = MessageType.SYSTEM
         self.chat: Chat = Chat()
+        self.cacheable = False
+
+    def print(self, text: str) -> None:
+        if not self.quiet:
+            print(text)
 
     def system(self) -> str:
         self.role = MessageType.SYSTEM
-        print(f"\n--- {self.role} ---\n")
+        self.print(f"\n--- {self.role} ---\n")
         return ""
 
     def user(self) -> str:
         self.role = MessageType.USER
-        print(f"\n--- {self.role} ---\n")
+        self.print(f"\n--- {self.role} ---\n")
         return ""
 
-    def assistant(self) -> str:
+    def cache(self) -> str:
+        """
+        Mark the current message as a stable prefix for prompt caching.
+        """
+
+        self.cacheable = True
+        return ""
+
+    async def assistant(self) -> str:
         self.role = MessageType.AI
-        print(f"\n--- {self.role} ---\n")
+        self.print(f"\n--- {self.role} ---\n")
         result: str = ""
-        resp = completion(model=self.model, messages=self.chat.to_dict(), stream=True)
-        for part in resp:
-            content = part.choices[0].delta.content  # pyright: ignore
-            if content is not None:
-                result += content
+        messages = self.chat.to_dict(cache_control(self.model))
+        async for content in astream(self.model, messages, self.name):
+            result += content
+            if not self.quiet:
                 sys.stdout.write(content)
         return result
 
     def add_message(self, msg: Message):
         self.chat.add_message(msg)
+        self.cacheable = False
         if msg.msg_type != MessageType.AI:
-            print(msg.content)
+            self.print(msg.content)
+
+    def fork(self) -> "Conversation":
+        """
+        Quiet copy of the conversation, its messages are printed when
+        it is merged back.
+        """
+
+        branch = Conversation(self.model, True, self.name)
+        branch.chat = Chat(messages=list(self.chat.messages))
+        # text before the first role call of the branch keeps the role
+        branch.role = self.role
+        branch.cacheable = self.cacheable
+        return branch
+
+    def merge(self, branch: "Conversation", start: int) -> str:
+        """
+        Append messages added to `branch` after `start` and return the
+        last assistant answer.
+        """
 
-    def run(self, context: List[ContextFile], inputs: List[str] = []) -> None:
-        env = Environment(
-            autoescape=select_autoescape(),
+        result = ""
+        for msg in branch.chat.messages[start:]:
+            self.role = msg.msg_type
+            self.print(f"\n--- {self.role} ---\n")
+            self.print(msg.content)
+            self.chat.add_message(msg)
+            if msg.msg_type == MessageType.AI:
+                result = msg.content
+        return result
+
+
+class Template:
+    """
+    Conversation described by a jinja prompt. Segments separated by `---`
+    become messages and `{{ assistant() }}` is replaced by the model
+    answer. A quiet template prints nothing and never asks for missing
+    variables.
+
+    Segments are compiled once, so the same template can be run many
+    times, also concurrently.
+
+    A segment calling `{{ branch("name") }}` starts a branch that runs
+    with the following segments until the next branch or a segment
+    calling `{{ join() }}`. Consecutive branches start from the same
+    chat and run concurrently. Their messages are then appended in
+    declaration order and the last answer of each branch is available
+    as `branches.name`.
+
+    `{{ cache() }}` marks the message of its segment, like a system
+    prompt or a context block, as a prefix that providers may cache.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        prompt: str,
+        quiet: bool = False,
+        segments: Optional[List[Segment]] = None,
+        name: str = "",
+    ):
+        self.model = model
+        self.prompt = prompt
+        self.quiet = quiet
+        self.name = name
+        self.segments = segments if segments is not None else compile_prompt(prompt)
+
+    async def arun(
+        self,
+        context: Context,
+        inputs: List[str] = [],
+        variables: Optional[Dict[str, Any]] = None,
+    ) -> Chat:
+        """
+        Render the template, calling the model for each assistant
+        segment, and return the resulting chat.
+        """
+
+        conv = Conversation(self.model, self.quiet, self.name)
+        vars: dict[str, Any] = {"context": context, "inputs": inputs}
+        vars.update(variables or {})
+        if isinstance(context, Retriever):
+            # only the chunks relevant to the question are rendered
+            self._resolve({context.query}, vars)
+            vars["context"] = context.retrieve(str(vars[context.query]))
+        branches: Dict[str, str] = {}
+        forks: List[List[Segment]] = []
+
+        for segment in self.segments:
+            if segment.branch is not None:
+                forks.append([segment])
+                continue
+            if forks and not segment.join:
+                forks[-1].append(segment)
+                continue
+            if forks:
+                await self._join(conv, forks, vars, branches)
+                forks = []
+            await self._render(conv, segment, vars, branches)
+
+        if forks:
+            await self._join(conv, forks, vars, branches)
+        return conv.chat
+
+    def _resolve(self, names: Set[str], vars: Dict[str, Any]) -> None:
+        for var in names:
+            if var not in vars:
+                if self.quiet:
+                    raise ValueError("Missing template variable", var)
+                vars[var] = input(f"{var}: ").strip()
+
+    async def _render(
+        self,
+        conv: Conversation,
+        segment: Segment,
+        vars: Dict[str, Any],
+        branches: Dict[str, str],
+    ) -> None:
+        self._resolve(segment.variables, vars)
+        content = await segment.template.render_async(
+            system=conv.system,
+            user=conv.user,
+            assistant=conv.assistant,
+            cache=conv.cache,
+            branch=marker,
+            join=marker,
+            branches=branches,
+            **vars,
+        )
+        conv.add_message(
+            Message(
+                msg_type=conv.role, content=content.strip(), cacheable=conv.cacheable
+            )
         )
 
-        env.globals.update(system=lambda: self.system())
-        env.globals.update(assistant=lambda: self.assistant())
-        env.globals.update(user=lambda: self.user())
+    async def _join(
+        self,
+        conv: Conversation,
+        forks: List[List[Segment]],
+        vars: Dict[str, Any],
+        branches: Dict[str, str],
+    ) -> None:
+        # ask for missing variables before the branches run concurrently
+        for segments in forks:
+            for segment in segments:
+                self._resolve(segment.variables, vars)
+
+        start = len(conv.chat.messages)
+        forked = [conv.fork() for _ in forks]
+
+        async def run_branch(branch: Conversation, segments: List[Segment]) -> None:
+            for segment in segments:
+                await self._render(branch, segment, vars, branches)
 
-        chat = self.prompt.split("---")
+        await asyncio.gather(*[run_branch(b, s) for b, s in zip(forked, forks)])
+        for branch, segments in zip(forked, forks):
+            name = segments[0].branch or ""
+            branches[name] = conv.merge(branch, start)
 
-        for msg in chat:
-            parsed_content = env.parse(msg)
-            vars: dict[str, Any] = {"context": context, "inputs": inputs}
+    def run(self, context: Context, inputs: List[str] = []) -> None:
+        asyncio.run(self.arun(context, inputs))
 
-            for var in meta.find_undeclared_variables(parsed_content):
-                if var != "inputs" and var != "context":
-                    vars[var] = input(f"{var}: ").strip()
 
-            t = env.from_string(msg)
-            content = t.render(**vars).strip()
-            self.add_message(Message(msg_type=self.role, content=content))
+class PromptLoader(BaseLoader):
+    """
+    Serve each segment of a prompt file as a template named
+    `<path>#<index>`. Segments are reloaded when the file mtime changes.
+    """
+
+    def __init__(self):
+        self._prompts: Dict[str, Tuple[float, str]] = {}
+
+    def read(self, path: str) -> Tuple[float, str]:
+        mtime = os.path.getmtime(path)
+        cached = self._prompts.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "r") as f:
+                cached = (mtime, f.read())
+            self._prompts[path] = cached
+        return cached
+
+    def get_source(
+        self, environment: Environment, template: str
+    ) -> Tuple[str, str, Callable[[], bool]]:
+        path, _, index = template.rpartition("#")
+        mtime, prompt = self.read(path)
+        source = split_prompt(prompt)[int(index)]
+        return source, path, lambda: os.path.getmtime(path) == mtime
 
 
 class TemplateLoader:
     """
     Load templates following a path hierarchy. The first
-    template with provided name is returned.
+    template with provided name is returned, as resolved by the
+    catalog.
+
+    Compiled segments and their undeclared variables are kept per path
+    and reused until the file mtime changes. With `bytecode_dir` the
+    compiled code is also persisted between processes.
     """
 
-    def __init__(self, dirs: List[Path]):
+    def __init__(
+        self,
+        dirs: List[Path],
+        catalog: TemplateCatalog,
+        bytecode_dir: Optional[Path] = None,
+    ):
         self.dirs = dirs
+        self.catalog = catalog
+        self.prompts = PromptLoader()
+        self.env = create_environment(self.prompts, bytecode_dir)
+        self._compiled: Dict[Path, Tuple[float, str, List[Segment]]] = {}
+
+    def compile(self, path: Path) -> Tuple[str, List[Segment]]:
+        mtime, prompt = self.prompts.read(str(path))
+        cached = self._compiled.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
 
-    def get_by_name(self, model: str, name: str) -> Optional[Template]:
+        segments = [
+            compile_segment(self.env, source, self.env.get_template(f"{path}#{i}"))
+            for i, source in enumerate(split_prompt(prompt))
+        ]
+        self._compiled[path] = (mtime, prompt, segments)
+        return prompt, segments
+
+    def get_by_name(
+        self, model: str, name: str, quiet: bool = False
+    ) -> Optional[Template]:
         """
-        Iterate directories looking for file with given name. The
-        first one found is returned.
+        Look up template with given file name in the catalog.
         """
 
-        for d in self.dirs:
-            path = d.joinpath(name)
-            if path.exists():
-                with open(path, "r") as f:
-                    content = f.read()
-                    t = Template(model, content)
-                    return t
-        return None
-
-    def list(self):
-        # regex to find all entries with format {# summary: text #} and extract text
-        pattern = r"{#[\s]+summary:[\s]+(.*)[\s]*#}"
-
-        for d in self.dirs:
-            for f in d.glob("*.j2"):
-                path = d.joinpath(f.name)
-                content = path.read_text()
-
-                summary = ""
-                matches = re.findall(pattern, content)
-                for m in matches:
-                    summary += m.strip()
-
-                if summary == "":
-                    print(f"{f.name.rstrip('.j2')}")
-                else:
-                    print(f"{f.name.rstrip('.j2')}: {summary}")
+        stem = name[: -len(".j2")] if name.endswith(".j2") else name
+        entry = self.catalog.get(stem)
+        if entry is not None and not Path(entry.path).exists():
+            # removed since the catalog was refreshed
+            self.catalog.refresh()
+            entry = self.catalog.get(stem)
+        if entry is None:
+            return None
+
+        prompt, segments = self.compile(Path(entry.path))
+        return Template(model, prompt, quiet, segments, stem)
 
 
 if __name__ == "__main__":
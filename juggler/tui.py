@@ -1,10 +1,12 @@
-from litellm import acompletion
+from rich.text import Text
 from textual import log
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Container, ScrollableContainer
-from textual.css.query import NoMatches
-from textual.reactive import reactive
+from textual.message import Message as TextualMessage
+from textual.screen import ModalScreen
+from textual.timer import Timer
+from textual.worker import Worker
 from textual.widgets import (
     Static,
     Header,
@@ -13,15 +15,259 @@ from textual.widgets import (
     Input,
     Markdown,
     LoadingIndicator,
+    OptionList,
 )
+from textual.widgets.option_list import Option
+from juggler.compaction import Compactor
+from juggler.llm import astream, warm
 from juggler.message import Message, MessageType, Chat
-from typing import Optional, List
+from juggler.search import highlight
+from juggler.store import SearchHit, SessionStore
+from juggler.stream import BlockSplitter
+from typing import Coroutine, Optional, Dict, List, Set, Tuple
+import inspect
 import uuid
 from datetime import datetime
 
 
 class Body(ScrollableContainer):
-    pass
+    """
+    Chat transcript. Only a window of messages around the viewport is
+    mounted as baloons; messages outside of it are materialized in pages
+    as the user scrolls towards the top or bottom.
+    """
+
+    # number of mounted baloons, exceeded when a tall viewport needs more
+    WINDOW = 40
+    # number of baloons mounted at once
+    PAGE = 10
+    # distance in lines from the edge that triggers paging
+    MARGIN = 5
+
+    messages: List[Message]
+    # baloons kept mounted, see WINDOW
+    window_size: int
+    start: int
+    end: int
+    total: int
+    paging: bool
+    # scrolled to the bottom, where streamed content keeps it
+    following: bool
+    # baloons of the last entries, mounted below the window after it was
+    # paged up while they were still streaming
+    pinned: List["Baloon"]
+    # anchor and alignment scrolled to once the paged window is laid out
+    scroll_anchor: Optional[Tuple[Optional["Baloon"], bool]]
+
+    def __init__(self, *children, **kwargs):
+        super().__init__(*children, **kwargs)
+        self.messages = []
+        self.window_size = self.WINDOW
+        self.start = 0
+        self.end = 0
+        self.total = 0
+        self.paging = False
+        self.following = True
+        self.pinned = []
+        self.scroll_anchor = None
+
+    def on_mount(self) -> None:
+        self.screen.screen_layout_refresh_signal.subscribe(self, self._laid_out)
+
+    async def show(
+        self, messages: List[Message], position: Optional[int] = None
+    ) -> None:
+        """
+        Display messages, mounting only the last page, or the page around
+        the message at `position` which is scrolled to and marked.
+        """
+
+        self.paging = True
+        self.workers.cancel_group(self, "paging")
+        await self.query(Baloon).remove()
+        self.pinned = []
+        self.messages = messages
+        self.window_size = self.WINDOW
+        self.total = len(messages)
+        if position is None or not 0 <= position < self.total:
+            await self._mount_tail()
+        else:
+            await self._mount_at(position)
+
+    async def append(self, baloon: "Baloon") -> None:
+        """
+        Mount baloon for the message following the transcript. The
+        message may be added to `messages` only after streaming ends.
+        """
+
+        if self.end < self.total:
+            # window was moved up, jump back to the end
+            self.paging = True
+            self.workers.cancel_group(self, "paging")
+            for mounted in self._window():
+                await mounted.remove()
+            await self._mount_tail()
+
+        await self.mount(baloon)
+        self.total += 1
+        self.end = self.total
+        await self._trim_top()
+
+    async def _mount_tail(self) -> None:
+        end = self.total - len(self.pinned)
+        self.start = max(0, end - self.PAGE)
+        await self._mount_window(self.start, end)
+        self.pinned = []
+        self.end = self.total
+        self._paged_after_layout(None, False)
+
+    async def _mount_at(self, position: int) -> None:
+        self.start = max(0, min(position - self.PAGE // 2, self.total - self.PAGE))
+        self.end = min(self.total, self.start + self.PAGE)
+        baloons = self._baloons(self.start, self.end)
+        await self.mount_all(baloons)
+        match = baloons[position - self.start]
+        match.add_class("-match")
+        self._paged_after_layout(match, True)
+
+    def _baloons(self, start: int, end: int) -> List["Baloon"]:
+        return [
+            Baloon(m.msg_type, m.content, True) for m in self.messages[start:end]
+        ]
+
+    async def _mount_window(self, start: int, end: int) -> None:
+        baloons = self._baloons(start, end)
+        if not baloons:
+            return
+        if self.pinned:
+            await self.mount_all(baloons, before=self.pinned[0])
+        else:
+            await self.mount_all(baloons)
+
+    def _window(self) -> List["Baloon"]:
+        return [b for b in self.query(Baloon) if b not in self.pinned]
+
+    async def _mount_above(self) -> None:
+        mounted = list(self.query(Baloon))
+        start = max(0, self.start - self.PAGE)
+        await self.mount_all(
+            self._baloons(start, self.start), before=mounted[0] if mounted else None
+        )
+        self.start = start
+
+    async def _mount_below(self) -> None:
+        limit = min(self.total - len(self.pinned), len(self.messages))
+        end = min(limit, self.end + self.PAGE)
+        await self._mount_window(self.end, end)
+        self.end = end
+        if self.pinned and self.end == self.total - len(self.pinned):
+            # the window reached the pinned baloons again
+            self.pinned = []
+            self.end = self.total
+
+    async def _trim_top(self) -> None:
+        window = self._window()
+        while len(window) + len(self.pinned) > self.window_size and len(window) > 1:
+            await window.pop(0).remove()
+            self.start += 1
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        self.following = new_value >= self.max_scroll_y - self.MARGIN
+        if self.paging:
+            return
+
+        if new_value <= self.MARGIN and self.start > 0:
+            self.paging = True
+            self.run_worker(self.page_up(), group="paging", exclusive=True)
+        elif new_value >= self.max_scroll_y - self.MARGIN and self.end < min(
+            self.total - len(self.pinned), len(self.messages)
+        ):
+            self.paging = True
+            self.run_worker(self.page_down(), group="paging", exclusive=True)
+
+    async def page_up(self) -> None:
+        baloons = self.query(Baloon)
+        if not baloons:
+            self.paging = False
+            return
+
+        anchor = baloons.first()
+        await self._mount_above()
+
+        if self.end == self.total and self.total > len(self.messages):
+            # pin the baloons still streaming, only the window above moves
+            pending = self.total - len(self.messages)
+            self.pinned = list(self.query(Baloon))[-pending:]
+            self.end = len(self.messages)
+
+        # drop baloons from the bottom of the window
+        window = self._window()
+        while len(window) + len(self.pinned) > self.window_size and len(window) > 1:
+            await window.pop().remove()
+            self.end -= 1
+
+        self._paged_after_layout(anchor, True)
+
+    async def page_down(self) -> None:
+        baloons = self.query(Baloon)
+        if not baloons:
+            self.paging = False
+            return
+
+        window = self._window()
+        anchor = window[-1] if window else baloons.last()
+        await self._mount_below()
+        await self._trim_top()
+        self._paged_after_layout(anchor, False)
+
+    def _paged_after_layout(self, anchor: Optional["Baloon"], top: bool) -> None:
+        # geometry of the new baloons is only known after the next layout
+        self.scroll_anchor = (anchor, top)
+        self.refresh(layout=True)
+
+    def _laid_out(self) -> None:
+        if self.scroll_anchor is not None:
+            anchor, top = self.scroll_anchor
+            self.scroll_anchor = None
+            self._paged(anchor, top)
+        self._fill()
+
+    def _paged(self, anchor: Optional["Baloon"], top: bool) -> None:
+        # keep the previous edge in view, or the end of the transcript
+        # without an anchor
+        if anchor is not None:
+            self.scroll_to_widget(anchor, animate=False, top=top)
+        else:
+            self.scroll_end(animate=False)
+        self.paging = False
+
+    def _fill(self) -> None:
+        # a window that does not overflow the viewport cannot be scrolled
+        # to page it, so more messages are mounted until it does. It must
+        # overflow by a screen, or the scroll position a page leaves would
+        # already trigger paging back to the other edge.
+        if self.paging or self.max_scroll_y > self.size.height:
+            return
+        limit = min(self.total - len(self.pinned), len(self.messages))
+        if self.start > 0 or self.end < limit:
+            self.paging = True
+            self.run_worker(self._fill_page(), group="paging", exclusive=True)
+
+    async def _fill_page(self) -> None:
+        baloons = self.query(Baloon)
+        if self.start > 0:
+            # the end of a transcript stays in view, other windows keep
+            # their first baloon at the top
+            anchor = None if self.end == self.total else baloons.first()
+            top = True
+            await self._mount_above()
+        else:
+            anchor, top = baloons.last(), False
+            await self._mount_below()
+        # the page is needed on screen, trimming must not drop it again
+        self.window_size = max(self.window_size, len(self.query(Baloon)))
+        self._paged_after_layout(anchor, top)
 
 
 class ChatTitle(Static):
@@ -52,12 +298,28 @@ class BaloonMarkdown(Markdown):
 
 
 class Baloon(Container):
-    content = reactive("")
+    """
+    Chat message. Streamed deltas are buffered and rendered at most FPS
+    times per second. Completed markdown blocks are frozen in their own
+    widget, so each render only parses the block still being written.
+    """
+
+    # maximum number of renders per second while streaming
+    FPS = 15
+
+    class Flushed(TextualMessage):
+        """
+        Posted after buffered deltas were rendered.
+        """
+
     container: BaloonContainer
     markdown: BaloonMarkdown
+    splitter: BlockSplitter
     message_type: MessageType = MessageType.SYSTEM
     add_loaded: bool = False
     isloading: bool = True
+    dirty: bool = False
+    timer: Optional[Timer] = None
 
     def __init__(
         self, message_type: MessageType, content: str, add_loaded: bool = False
@@ -65,10 +327,14 @@ class Baloon(Container):
         super().__init__()
         self.message_type = message_type
         self.add_loaded = add_loaded
-        self.content = content
+        self.splitter = BlockSplitter(content)
         self.markdown = BaloonMarkdown(content)
         self.container = BaloonContainer(LoadingIndicator())
 
+    @property
+    def content(self) -> str:
+        return self.splitter.text
+
     def compose(self) -> ComposeResult:
         yield Avatar(self.message_type)
         yield self.container
@@ -79,22 +345,46 @@ class Baloon(Container):
                 widget.remove()
             self.container.mount(self.markdown)
             self.isloading = False
+            if not self.add_loaded:
+                self.timer = self.set_interval(1 / self.FPS, self.flush)
 
     def on_mount(self) -> None:
         if self.add_loaded:
             self.loaded()
 
-    def update(self, content: str):
-        self.content = content
-
     def update_delta(self, delta: str):
-        self.content += delta
+        self.splitter.feed(delta)
+        self.dirty = True
 
-    async def watch_content(self, content: str) -> None:
-        try:
-            await self.markdown.update(content)
-        except NoMatches:
-            pass
+    async def flush(self) -> None:
+        """
+        Render deltas received since the last flush.
+        """
+
+        if not self.dirty or self.isloading:
+            return
+        self.dirty = False
+
+        blocks = self.splitter.pop_blocks()
+        if blocks:
+            # freeze completed blocks and continue on a new widget
+            await self.markdown.update(blocks)
+            self.markdown = BaloonMarkdown()
+            await self.container.mount(self.markdown)
+        await self.markdown.update(self.splitter.tail)
+        self.post_message(self.Flushed())
+
+    async def finish(self) -> None:
+        """
+        Stop streaming and render remaining content.
+        """
+
+        self.loaded()
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        self.dirty = True
+        await self.flush()
 
 
 class SessionButton(Button):
@@ -112,13 +402,17 @@ class SessionButton(Button):
 
 
 class Sidebar(ScrollableContainer):
-    sessions: List[Chat] = []
+    sessions: Dict[str, Chat]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sessions = {}
 
     def compose(self) -> ComposeResult:
         yield Title("Sessions")
 
     async def add_session(self, chat: Chat) -> None:
-        self.sessions.append(chat)
+        self.sessions[chat.session_id] = chat
         session_button = SessionButton(chat.session_id, chat.title or "New chat")
         await self.mount(session_button)
 
@@ -128,7 +422,7 @@ class Sidebar(ScrollableContainer):
 
     async def refresh_sessions(self) -> None:
         self.remove_all_sessions()
-        for chat in self.sessions:
+        for chat in self.sessions.values():
             session_button = SessionButton(chat.session_id, chat.title or "New chat")
             await self.mount(session_button)
 
@@ -175,12 +469,69 @@ class Sidebar(ScrollableContainer):
         self.app.set_sidebar(False)
 
 
+# appended to replies stopped before their end
+TRUNCATED = "\n\n*[truncated]*"
+
+
+class SearchScreen(ModalScreen[SearchHit]):
+    """
+    Search box over the messages of every session. Hits are updated as
+    the query is typed, selecting one dismisses the screen with it.
+    """
+
+    BINDINGS = [Binding("escape", "dismiss", "Close")]
+
+    def __init__(self, store: SessionStore):
+        super().__init__()
+        self.store = store
+        self.hits: List[SearchHit] = []
+
+    def compose(self) -> ComposeResult:
+        yield Container(Input(placeholder="Search messages"), OptionList())
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        event.stop()
+        self.hits = self.store.search(event.value)
+        options = self.query_one(OptionList)
+        options.clear_options()
+        options.add_options(
+            [
+                Option(
+                    Text.assemble(
+                        (hit.title.strip() or "New chat", "bold"),
+                        "\n",
+                        highlight(hit.snippet),
+                    )
+                )
+                for hit in self.hits
+            ]
+        )
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        # enter in the search box opens the best hit
+        event.stop()
+        if self.hits:
+            self.dismiss(self.hits[0])
+
+    def on_option_list_option_selected(self, event: OptionList.OptionSelected) -> None:
+        self.dismiss(self.hits[event.option_index])
+
+
 class Juggler(App[None]):
+    """
+    Chat sessions. Each session streams at most one reply at a time.
+    Messages sent meanwhile are queued and answered together once it
+    ends, or with `on_busy="replace"` the reply is stopped and they are
+    answered right away.
+    """
+
     TITLE = "Juggler"
     CSS_PATH = "juggler.tcss"
     BINDINGS = [
         Binding("f2", "toggle_sidebar", "Sidebar"),
         Binding("ctrl+n", "new_chat", "New"),
+        Binding("escape", "stop", "Stop"),
+        Binding("ctrl+r", "search", "Search"),
         Binding("ctrl+q", "app.quit", "Quit", show=True),
     ]
 
@@ -189,11 +540,28 @@ class Juggler(App[None]):
     current_title: ChatTitle = ChatTitle("New chat")
     body: Body
     sidebar: Sidebar
-    sessions: List[Chat] = []
+    sessions: Dict[str, Chat]
+    loaded_sessions: Set[str]
 
-    def __init__(self, model: str):
+    def __init__(
+        self,
+        model: str,
+        store: SessionStore,
+        compactor: Optional[Compactor] = None,
+        on_busy: str = "queue",
+    ):
         super(Juggler, self).__init__()
         self.model = model
+        self.store = store
+        self.compactor = compactor
+        self.on_busy = on_busy
+        # sessions with a summary being written
+        self.compacting: Set[str] = set()
+        # streaming reply and messages waiting for it, by session
+        self.replies: Dict[str, Tuple[Worker, Coroutine]] = {}
+        self.queued: Dict[str, List[str]] = {}
+        self.sessions = {}
+        self.loaded_sessions = set()
 
     def compose(self) -> ComposeResult:
         yield Container(
@@ -206,13 +574,24 @@ class Juggler(App[None]):
             Footer(),
         )
 
-    def on_mount(self) -> None:
+    async def on_mount(self) -> None:
+        # the title and the first answer are requested together
+        self.run_worker(warm(self.model, 2))
         input = self.query_one(Input)
         input.focus()
         self.body = self.query_one(Body)
         self.sidebar = self.query_one(Sidebar)
         self.set_sidebar(False)
+        self.load_sessions()
         self.create_new_session()
+        await self.body.show(self.current_chat.messages)
+
+    def load_sessions(self) -> None:
+        # only metadata is read here, messages are loaded on demand
+        for chat in self.store.list_sessions():
+            self.sessions[chat.session_id] = chat
+            self.sidebar.sessions[chat.session_id] = chat
+        self.run_worker(self.sidebar.refresh_sessions())
 
     def set_sidebar(self, open: bool) -> None:
         sidebar = self.query_one(Sidebar)
@@ -238,118 +617,202 @@ class Juggler(App[None]):
             input = self.query_one(Input)
             input.focus()
 
-    async def update_chat_name(self) -> None:
-        prompt = f"Summarize in one short sentence the following message:\n\n{self.current_chat.messages[0].content}"
+    async def update_chat_name(self, chat: Chat) -> None:
+        prompt = f"Summarize in one short sentence the following message:\n\n{chat.messages[0].content}"
         messages = [
             {"role": "user", "content": prompt},
         ]
 
-        resp = await acompletion(model=self.model, messages=messages, stream=True)
-        async for part in resp:  # pyright: ignore
-            if part.choices[0].delta.content is not None:
-                self.current_chat.title += part.choices[0].delta.content
-                self.current_title.update(self.current_chat.title)
+        async for content in astream(self.model, messages, "tui-title"):
+            chat.title += content
+            if chat is self.current_chat:
+                self.current_title.update(chat.title)
 
-        self.save_current_session()
+        self.save_session(chat)
         self.run_worker(self.sidebar.refresh_sessions())
 
-    async def update_chat(self) -> None:
-        # add current assistant baloon
-        body = self.query_one(Body)
-        self.current_baloon = Baloon(MessageType.AI, "")
-        await body.mount(self.current_baloon)
-
-        messages = self.current_chat.to_dict()
-        resp = await acompletion(model=self.model, messages=messages, stream=True)
-        self.current_baloon.loaded()
-        async for part in resp:  # pyright: ignore
-            if part.choices[0].delta.content is not None:
-                self.current_baloon.update_delta(part.choices[0].delta.content)
-                self.body.scroll_end()
-
-        self.current_chat.add_message(
-            Message(msg_type=MessageType.AI, content=self.current_baloon.content)
-        )
-        self.body.scroll_end()
-        self.save_current_session()
+    def request_reply(self, chat: Chat) -> None:
+        reply = self.update_chat(chat)
+        self.replies[chat.session_id] = (self.run_worker(reply), reply)
+
+    def stop_reply(self, chat: Chat) -> None:
+        """
+        Cancel the reply streaming in `chat`. A reply cancelled before it
+        started never reaches the cleanup of `update_chat`, so it is
+        done here.
+        """
+
+        if chat.session_id not in self.replies:
+            return
+        worker, reply = self.replies[chat.session_id]
+        started = inspect.getcoroutinestate(reply) != inspect.CORO_CREATED
+        worker.cancel()
+        if not started:
+            reply.close()
+            del self.replies[chat.session_id]
+            self.next_reply(chat)
+
+    async def update_chat(self, chat: Chat) -> None:
+        """
+        Stream the reply to `chat`. A reply stopped before its end keeps
+        the content received so far, marked as truncated.
+        """
+
+        baloon = Baloon(MessageType.AI, "")
+        completed = False
+        try:
+            if chat is self.current_chat:
+                self.current_baloon = baloon
+                await self.body.append(baloon)
+
+            if self.compactor is None:
+                messages = chat.to_dict()
+            else:
+                messages = self.compactor.messages(chat)
+            async for content in astream(self.model, messages, "tui"):
+                # the session may have been switched away from
+                if baloon.is_attached:
+                    baloon.loaded()
+                baloon.update_delta(content)
+            completed = True
+        finally:
+            if not completed:
+                baloon.update_delta(TRUNCATED)
+            self.add_message(
+                Message(msg_type=MessageType.AI, content=baloon.content), chat
+            )
+            del self.replies[chat.session_id]
+            self.next_reply(chat)
+            if baloon.is_attached:
+                await baloon.finish()
+                if self.body.following:
+                    self.body.scroll_end()
+            elif chat is self.current_chat:
+                await self.body.show(chat.messages)
+
+        if (
+            self.compactor is not None
+            and chat.session_id not in self.compacting
+            and self.compactor.pending(chat)
+        ):
+            self.run_worker(self.compact_chat(chat))
+
+    async def compact_chat(self, chat: Chat) -> None:
+        assert self.compactor is not None
+        self.compacting.add(chat.session_id)
+        try:
+            await self.compactor.compact(chat, self.model)
+            self.store.save_summary(chat)
+        finally:
+            self.compacting.discard(chat.session_id)
+
+    def on_baloon_flushed(self, event: Baloon.Flushed) -> None:
+        if self.body.following and self.body.end == self.body.total:
+            self.body.scroll_end(animate=False)
+
+    def next_reply(self, chat: Chat) -> None:
+        """
+        Answer the messages queued while the last reply was streaming.
+        """
+
+        queued = self.queued.pop(chat.session_id, [])
+        if not queued:
+            return
+        for content in queued:
+            self.add_message(Message(msg_type=MessageType.USER, content=content), chat)
+        self.request_reply(chat)
 
     async def on_input_submitted(self, event: Input.Submitted) -> None:
         if event.value == "":
             # ignore if no text was input
             return
 
-        # add user baloon and fill with content
-        self.current_chat.add_message(
-            Message(msg_type=MessageType.USER, content=event.value)
-        )
-        body = self.query_one(Body)
+        chat = self.current_chat
         user_baloon = Baloon(MessageType.USER, event.value, True)
-        await body.mount(user_baloon)
+        await self.body.append(user_baloon)
+        content = event.value
         event.input.value = ""
 
+        if chat.session_id in self.replies:
+            # the message is added once the reply ends, to keep the order
+            self.queued.setdefault(chat.session_id, []).append(content)
+            if self.on_busy == "replace":
+                self.stop_reply(chat)
+            return
+
+        self.add_message(Message(msg_type=MessageType.USER, content=content), chat)
+
         # if this is the first message, update chat title
-        if len(self.current_chat.messages) == 1:
-            self.run_worker(self.update_chat_name())
+        if len(chat.messages) == 1:
+            self.run_worker(self.update_chat_name(chat))
 
         # call completion
-        self.run_worker(self.update_chat())
-        self.save_current_session()
+        self.request_reply(chat)
+
+    def action_stop(self) -> None:
+        # queued messages are still answered
+        self.stop_reply(self.current_chat)
 
     def create_new_session(self) -> None:
         session_id = str(uuid.uuid4())
         created_at = datetime.now().isoformat()
         self.current_chat = Chat(session_id=session_id, created_at=created_at)
+        self.loaded_sessions.add(session_id)
+
+    def add_message(self, msg: Message, chat: Optional[Chat] = None) -> None:
+        """
+        Add message to a chat, the current one by default, and append it
+        to the store.
+        """
+
+        chat = chat or self.current_chat
+        chat.add_message(msg)
+        self.store.append_message(chat, msg)
+        self.save_session(chat)
 
     def save_current_session(self) -> None:
-        if self.current_chat.session_id:
-            existing_session = next(
-                (
-                    s
-                    for s in self.sessions
-                    if s.session_id == self.current_chat.session_id
-                ),
-                None,
-            )
-            if existing_session:
-                existing_session.title = self.current_chat.title
-                existing_session.messages = self.current_chat.messages
-            else:
-                self.sessions.append(self.current_chat)
-                self.run_worker(self.sidebar.add_session(self.current_chat))
+        self.save_session(self.current_chat)
 
-    async def switch_to_session(self, session_id: str) -> None:
+    def save_session(self, chat: Chat) -> None:
+        # empty chats are not persisted nor listed
+        if not chat.session_id or not chat.messages:
+            return
+
+        self.store.save_session(chat)
+        if chat.session_id not in self.sessions:
+            self.sessions[chat.session_id] = chat
+            self.run_worker(self.sidebar.add_session(chat))
+
+    async def switch_to_session(
+        self, session_id: str, position: Optional[int] = None
+    ) -> None:
         try:
             self.save_current_session()
 
-            session = next(
-                (s for s in self.sessions if s.session_id == session_id), None
-            )
+            session = self.sessions.get(session_id)
             if session:
+                if session_id not in self.loaded_sessions:
+                    session.messages = self.store.load_messages(session_id)
+                    self.loaded_sessions.add(session_id)
+
                 self.current_chat = session
                 self.current_title.update(session.title or "New chat")
-
-                # Remove existing balloons
-                for baloon in self.query(Baloon):
-                    baloon.remove()
-
-                # Add messages from the session one by one with small delays
-                for i, message in enumerate(session.messages):
-                    baloon = Baloon(message.msg_type, message.content, True)
-                    await self.body.mount(baloon)
-                    # Small delay to prevent blocking
-                    if i % 5 == 0:  # Every 5 messages, yield control
-                        await self.sleep(0.01)
-
-                self.body.scroll_end()
+                await self.body.show(session.messages, position)
         except Exception as e:
             log(f"Error switching session: {e}")
 
-    def action_new_chat(self) -> None:
+    async def action_new_chat(self) -> None:
         self.save_current_session()
         self.current_baloon = None
         self.create_new_session()
         self.current_title.update("New chat")
-        self.query(Baloon).remove()
+        await self.body.show(self.current_chat.messages)
+
+    def action_search(self) -> None:
+        self.push_screen(SearchScreen(self.store), self.open_hit)
+
+    async def open_hit(self, hit: SearchHit) -> None:
+        await self.switch_to_session(hit.session_id, hit.position)
 
     def action_toggle_sidebar(self) -> None:
         sidebar = self.query_one(Sidebar)